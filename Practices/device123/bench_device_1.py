@@ -0,0 +1,50 @@
+"""
+Benchmark of the device_1 parsers: the whole-file path (parse_device_1) against the streaming one
+(iter_device_1 over read_chunks). Each path runs in its own process so its peak memory can be reported.
+
+A capture of the requested size is built by repeating device_1.txt; it is kept and reused between runs.
+
+Usage:
+    python bench_device_1.py [capture size in MB] [chunk size in KB] [capture path]
+"""
+import os, resource, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from device123 import PacketParser
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "device_1.txt")
+
+def make_capture(path: str, size: int):
+    if os.path.exists(path) and os.path.getsize(path) >= size:
+        return
+    with open(SAMPLE, "rb") as file:
+        sample = file.read().strip() + b"\r\n\r\n\r\n"
+    block = sample * max(1, (1 << 20) // len(sample))
+    with open(path, "wb") as file:
+        written = 0
+        while written < size:
+            file.write(block)
+            written += len(block)
+
+def run(mode: str, path: str, chunk_size: int):
+    parser = PacketParser()
+    started = time.perf_counter()
+    if mode == "whole-file":
+        packets = len(parser.parse_device_1(file_path=path))
+    else:
+        packets = sum(1 for _ in parser.iter_device_1(parser.read_chunks(path, chunk_size)))
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    print(f"{mode:<11} {elapsed:9.2f} s {packets / elapsed:14,.0f} packets/s {os.path.getsize(path) / elapsed / 2**20:9.1f} MB/s {peak:10,.0f} MB peak RSS")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--run":
+        run(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+        sys.exit()
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1024
+    path = sys.argv[3] if len(sys.argv) > 3 else os.path.join(tempfile.gettempdir(), f"device_1_{size}MB.txt")
+    make_capture(path, size * 2**20)
+    print(f"Capture: {path} ({os.path.getsize(path) / 2**20:,.0f} MB), chunks of {chunk_size} KB")
+    for mode in ("whole-file", "streaming"):
+        subprocess.run([sys.executable, __file__, "--run", mode, path, str(chunk_size * 1024)], check=True)
@@ -1,7 +1,218 @@
+import json
+import os
+import re
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+
+# Byte lookup tables for the batch decoders: ASCII digits, and the characters str.strip() removes
+DIGITS = np.zeros(256, dtype=bool)
+DIGITS[48:58] = True
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[list(b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f')] = True
+# Fixed-width profile unit types as NumPy types, big-endian like the hex payloads
+UNIT_DTYPES = {'WORD': '>i2', 'UWORD': '>u2', 'INT': '>i4', 'UINT': '>u4', 'BOOL': 'u1', 'ENUM': 'u1'}
+PROFILE_KEY_ATTRIBUTES = ('model', 'profileVersion', 'voxpVersion')
+PROFILE_TAG = re.compile(r'<profile\b[^>]*>')
+XML_ATTRIBUTE = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# CRC-16 of the <data> payloads: over the hex text as sent, MSB first, initial value 0, no final xor
+CRC16_POLY = 0x2043
+
+def crc16_table(poly: int):
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+CRC16_TABLE = crc16_table(CRC16_POLY)
+
+def crc16(data: bytes):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+@lru_cache(maxsize=1024)
+def payload_crc(hex_data: str):
+    """
+    crc16 of a <data> payload, memoized: setting and alarm messages repeat unchanged for long stretches.
+    """
+    return crc16(hex_data.encode('ascii'))
+
+class ProfileCache:
+    """
+    LRU cache of compiled device_3 profiles keyed by (model, profileVersion, voxpVersion).
+    The key is read from the attributes of the <profile> tag, so a known profile is never parsed again;
+    a new one is parsed with ElementTree and compiled once. With a directory, parsed profiles are also
+    kept there as JSON and survive restarts.
+    """
+    def __init__(self, parser, max_size: int = 16, directory: str = None):
+        self.parser = parser
+        self.max_size = max_size
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, profile_xml: str):
+        """
+        Returns the cache key of a profile, or None when one of the key attributes is missing.
+        """
+        tag = PROFILE_TAG.search(profile_xml)
+        if tag is None:
+            return None
+        attributes = {name: double or single for name, double, single in XML_ATTRIBUTE.findall(tag.group())}
+        if any(attribute not in attributes for attribute in PROFILE_KEY_ATTRIBUTES):
+            return None
+        return tuple(attributes[attribute] for attribute in PROFILE_KEY_ATTRIBUTES)
+
+    def get(self, profile_xml: str):
+        """
+        Returns the compiled profile (see PacketParser.compile_profile) of the given <profile> XML.
+        """
+        return self.lookup(self.key(profile_xml), lambda: self.parser.parse_profile(profile_xml))
+
+    def get_element(self, element: ET.Element):
+        """
+        Same as get, for a <profile> element that is already parsed.
+        """
+        key = None
+        if all(attribute in element.attrib for attribute in PROFILE_KEY_ATTRIBUTES):
+            key = tuple(element.get(attribute) for attribute in PROFILE_KEY_ATTRIBUTES)
+        return self.lookup(key, lambda: self.parser.parse_profile_element(element))
+
+    def lookup(self, key: tuple, parse_profile):
+        if key is None:
+            self.misses += 1
+            return self.parser.compile_profile(parse_profile())
+        compiled = self.entries.get(key)
+        if compiled is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return compiled
+        self.misses += 1
+        profile = self.load(key)
+        if profile is None:
+            profile = parse_profile()
+            self.save(key, profile)
+        compiled = self.entries[key] = self.parser.compile_profile(profile)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return compiled
+
+    def path(self, key: tuple):
+        return os.path.join(self.directory, re.sub(r'[^\w.-]', '_', '_'.join(key)) + '.json')
+
+    def load(self, key: tuple):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as file:
+                profile = json.load(file)
+        except (OSError, ValueError):
+            return None
+        # The file name may be shared by keys differing only in replaced characters
+        if tuple(profile.get(attribute) for attribute in PROFILE_KEY_ATTRIBUTES) != key:
+            return None
+        return profile
+
+    def save(self, key: tuple, profile: dict):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        with open(path + '.tmp', 'w', encoding='utf-8') as file:
+            json.dump(profile, file)
+        os.replace(path + '.tmp', path)
+
+    def stats(self):
+        return {"profiles": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+class Device3Stream:
+    """
+    Incremental reader of a device_3 feed, for continuous monitors.
+    Bytes are fed as they arrive to an ElementTree XMLPullParser, inside a synthetic <stream> root since
+    the feed is a sequence of top-level elements. Every completed top-level element becomes an event:
+        ('profile', compiled profile)   from the parser's profile cache
+        ('data', message)               message as returned by parse_data, crc verified
+        ('crc_error', message)          a <data> message whose payload does not match its crc
+    and is then removed from the tree, so memory stays flat however long the session is.
+    Raises ET.ParseError on malformed XML.
+    """
+    def __init__(self, parser, verify_crc: bool = True):
+        self.parser = parser
+        self.verify_crc = verify_crc
+        self.pull = ET.XMLPullParser(events=('start', 'end'))
+        self.pull.feed(b'<stream>')
+        self.root = None
+        self.depth = 0
+        self.profile = None
+        self.messages = 0
+        self.crc_errors = 0
+
+    def feed(self, chunk: bytes):
+        """
+        Feed the next bytes of the stream and return the events of the elements they complete.
+        """
+        self.pull.feed(chunk.translate(None, b'\x1b'))
+        return self.read_events()
+
+    def close(self):
+        """
+        End the stream and return the events of the elements completed by the end.
+        """
+        self.pull.feed(b'</stream>')
+        events = self.read_events()
+        self.pull.close()
+        return events
+
+    def read_events(self):
+        events = []
+        for event, element in self.pull.read_events():
+            if event == 'start':
+                self.depth += 1
+                if self.root is None:
+                    self.root = element
+                continue
+            self.depth -= 1
+            if self.depth != 1:
+                continue
+            if element.tag == 'profile':
+                self.profile = self.parser.profile_cache.get_element(element)
+                events.append(('profile', self.profile))
+            elif element.tag == 'data':
+                events.append(self.read_data(element))
+            self.root.remove(element)
+        return events
+
+    def read_data(self, element: ET.Element):
+        hex_data = (element.text or '').strip()
+        message = {
+            "data_info": {
+                "class": element.get("class"),
+                "crc": element.get("crc"),
+                "msgID": element.get("msgID"),
+            },
+            "hex_data": hex_data,
+        }
+        self.messages += 1
+        crc = element.get("crc")
+        if self.verify_crc and crc is not None:
+            try:
+                valid = payload_crc(hex_data) == int(crc, 16)
+            except (UnicodeEncodeError, ValueError):
+                valid = False
+            if not valid:
+                self.crc_errors += 1
+                return ('crc_error', message)
+        return ('data', message)
 
 class PacketParser:
-    def __init__(self):
+    def __init__(self, profile_cache_size: int = 16, profile_cache_dir: str = None):
         self.ventilation_mode_start = 48
         self.ventilation_mode_length = 1        
         self.ventilation_modes = {
@@ -27,6 +238,8 @@ class PacketParser:
             'ExpiratoryTime': (202, 3, 0.1),
         }
         self.classes = ['setting', 'monitor', 'alarm']
+        self.compile_layouts()
+        self.profile_cache = ProfileCache(self, max_size=profile_cache_size, directory=profile_cache_dir)
     
     def split_by_newlines(self, data: str):
         """
@@ -93,6 +306,50 @@ class PacketParser:
         
         return parsed_packages
 
+    def read_chunks(self, file_path: str, chunk_size: int = 1 << 20):
+        """
+        Reads the given file in binary chunks of `chunk_size` bytes.
+        Yields the chunks one by one, ready for `iter_device_1`.
+        """
+        with open(file_path, 'rb') as file:
+            while chunk := file.read(chunk_size):
+                yield chunk
+
+    def parse_packet_1(self, package: str):
+        """
+        Parse one device_1 package ('NAME:value|NAME:value|...') into a dictionary in a single pass,
+        without building the intermediate field lists.
+        """
+        parsed_data = {}
+        for field in package.split('|'):
+            alan_ismi, colon, alan_degeri = field.partition(':')
+            if colon:
+                parsed_data[alan_ismi.strip()] = alan_degeri.strip()
+        return parsed_data
+
+    def iter_device_1(self, chunks):
+        """
+        Streaming version of parse_device_1 for continuous device output.
+        Consumes an iterable of bytes chunks (a file, a socket, a pipe) that may cut packages anywhere,
+        and yields the parsed dictionaries one at a time. Only the unfinished package is kept between
+        chunks, so memory stays constant however long the stream runs.
+
+        Usage:
+            parser.iter_device_1(parser.read_chunks('device_1.txt'))
+            parser.iter_device_1(iter(lambda: sock.recv(65536), b''))
+        """
+        tail = b''
+        for chunk in chunks:
+            # CR and ESC are dropped like read_from_file does, so separators are always '\n\n\n'
+            *packages, tail = (tail + chunk.translate(None, b'\r\x1b')).split(b'\n\n\n')
+            for package in packages:
+                package = package.strip()
+                if package:
+                    yield self.parse_packet_1(package.decode('utf-8'))
+        tail = tail.strip()
+        if tail:
+            yield self.parse_packet_1(tail.decode('utf-8'))
+
     def find_subpackages(self, data: list[str]):
         splitted_subs = []
         for packages in data:
@@ -136,6 +393,76 @@ class PacketParser:
         
         return parsed_data
 
+    def compile_layouts(self):
+        """
+        Compile vtu_fields and ventilation_modes into the tables used by the batch decoders: the :VTu fields
+        grouped by width with their column indices, and a 256 entry lookup table from mode code to mode name.
+        Call it again after changing vtu_fields or ventilation_modes.
+        """
+        groups = {}
+        for field_name, (start, length, multiplier) in self.vtu_fields.items():
+            groups.setdefault(length, []).append((field_name, start, multiplier))
+        self.vtu_groups = [
+            (
+                [field_name for field_name, _, _ in fields],
+                np.array([start for _, start, _ in fields])[:, None] + np.arange(length),
+                np.array([multiplier for _, _, multiplier in fields])
+            )
+            for length, fields in groups.items()
+        ]
+        self.vtu_width = max(start + length for start, length, _ in self.vtu_fields.values())
+
+        self.vtv_labels = np.array(list(self.ventilation_modes.values()) + ['Unknown'], dtype=object)
+        self.vtv_codes = np.full(256, len(self.ventilation_modes), dtype=np.intp)
+        for i, code in enumerate(self.ventilation_modes):
+            self.vtv_codes[ord(code)] = i
+
+    def packet_matrix(self, packets, width: int):
+        """
+        Lay packets (str or bytes) out as an (n, width) uint8 matrix, cut or padded with spaces to `width`
+        characters, so that every fixed-width field is a block of columns.
+        """
+        rows = b''.join(
+            (packet.encode('ascii', 'replace') if isinstance(packet, str) else packet)[:width].ljust(width)
+            for packet in packets
+        )
+        return np.frombuffer(rows, dtype=np.uint8).reshape(-1, width)
+
+    def decode_vtu_batch(self, packets):
+        """
+        Decode many :VTu packets at once, the fields of one width together, one character column at a time.
+        Returns a dictionary with one float64 array per vtu_fields entry, NaN where parse_vtu_packet gives None.
+        """
+        matrix = self.packet_matrix(packets, self.vtu_width)
+        columns = {}
+        for field_names, indices, multipliers in self.vtu_groups:
+            chars = matrix[:, indices]  # (packets, fields, width)
+            values = np.zeros(chars.shape[:2], dtype=np.int64)
+            started = np.zeros(chars.shape[:2], dtype=bool)
+            ended = np.zeros(chars.shape[:2], dtype=bool)
+            invalid = np.zeros(chars.shape[:2], dtype=bool)
+            # Same rule as strip().isdigit(): a single run of digits with only whitespace around it
+            for column in np.moveaxis(chars, 2, 0):
+                is_digit = DIGITS[column]
+                is_space = WHITESPACE[column]
+                invalid |= ~(is_digit | is_space) | (is_digit & ended)
+                ended |= is_space & started
+                started |= is_digit
+                values = np.where(is_digit, values * 10 + column - 48, values)
+            decoded = np.where(started & ~invalid, values * multipliers, np.nan)
+            for i, field_name in enumerate(field_names):
+                columns[field_name] = decoded[:, i]
+        return {field_name: columns[field_name] for field_name in self.vtu_fields}
+
+    def decode_vtv_batch(self, packets):
+        """
+        Decode the ventilation mode of many :VTv packets at once.
+        Returns an array of mode names, 'Unknown' for codes missing from ventilation_modes.
+        """
+        start = self.ventilation_mode_start
+        matrix = self.packet_matrix(packets, start + 1)
+        return self.vtv_labels[self.vtv_codes[matrix[:, start]]]
+
     def parse_device_2(self, file_path: str):
         parsed_packages = []
         
@@ -143,6 +470,18 @@ class PacketParser:
         packages = self.split_by_newlines(data=data)
         return self.find_subpackages(packages)
 
+    def parse_device_2_columns(self, file_path: str):
+        """
+        Columnar version of parse_device_2: every :VTu and :VTv line of the file, main packages and
+        subpackages alike, decoded in one batch per packet type.
+        Returns {'VTu': {field_name: array}, 'VTv': {'VentilationMode': array}}.
+        """
+        lines = [line.strip() for line in self.read_from_file(file_path=file_path).split('\n')]
+        return {
+            'VTu': self.decode_vtu_batch([line for line in lines if line.startswith(':VTu')]),
+            'VTv': {'VentilationMode': self.decode_vtv_batch([line for line in lines if line.startswith(':VTv')])}
+        }
+
     def convert_scale(self, scale: str):
         if scale is not None and scale.startswith('E+'): 
             scale.replace('E+', '')
@@ -150,22 +489,23 @@ class PacketParser:
         except: return 0
 
     def find_profile_n_data(self, splitted_packages: list[str]):
-        profile: str = None
-        for order, pack in enumerate(splitted_packages):
-            if pack.startswith('<profile'):
-                profile = splitted_packages.pop(order)
-        parsed_profile = self.parse_profile(profile)
-        parsed_data = [self.parse_data(data) for data in splitted_packages]
-        class_seperated_units = self.seperated_by_classes(parsed_profile['units'], 'unit')
+        profiles = [pack for pack in splitted_packages if pack.startswith('<profile')]
+        profile: str = profiles[-1] if profiles else None
+        compiled_profile = self.profile_cache.get(profile)
+        parsed_data = [self.parse_data(data) for data in splitted_packages if not data.startswith('<profile')]
         class_seperated_datas = self.seperated_by_classes(parsed_data, 'data')
-        parsed_profile['units'] = class_seperated_units
-        return parsed_profile, class_seperated_datas
+        return compiled_profile, class_seperated_datas
 
     def parse_profile(self, profile_xml: str):
         """
         Parse the profile XML, extract units, and return them as a list of unit information.
         """
-        root = ET.fromstring(profile_xml)
+        return self.parse_profile_element(ET.fromstring(profile_xml))
+
+    def parse_profile_element(self, root: ET.Element):
+        """
+        Same as parse_profile, for a <profile> element that is already parsed.
+        """
         units = []
 
         for unit in root.findall(".//unit"):
@@ -324,6 +664,109 @@ class PacketParser:
                 elif class_name == 'monitor': self.monitor[unit['ID']] = decoded
                 elif class_name == 'alarm': self.alarm[unit['ID']] = decoded
 
+    def compile_class_layout(self, units: list[dict]):
+        """
+        Compile the units of one class into a byte-level record layout: a structured dtype placing every
+        unit at its byte offset, the dtype of a decoded record (float64 for scaled units, bool for BOOL)
+        and the scales to divide by, following decode_content.
+        Raises ValueError for TEXT units, whose width depends on the data.
+        """
+        names, formats, offsets, decoded_formats, scales = [], [], [], [], {}
+        offset = 0
+        for unit in units:
+            if unit['type'] not in UNIT_DTYPES:
+                raise ValueError(f"Unit {unit['ID']} of type {unit['type']} has no fixed width")
+            raw_format = np.dtype(UNIT_DTYPES[unit['type']])
+            names.append(unit['ID'])
+            formats.append(raw_format)
+            offsets.append(offset)
+            offset += raw_format.itemsize
+            if unit['type'] == 'BOOL':
+                decoded_formats.append(np.bool_)
+            elif unit['scale'] is not None and unit['scale'] not in [0, 1]:
+                decoded_formats.append(np.float64)
+                scales[unit['ID']] = unit['scale']
+            else:
+                decoded_formats.append(raw_format.newbyteorder('='))
+        return {
+            'raw': np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': offset}),
+            'decoded': np.dtype({'names': names, 'formats': decoded_formats}),
+            'scales': scales,
+            'units': units
+        }
+
+    def compile_profile(self, profile: dict):
+        """
+        Compile a profile returned by parse_profile into one record layout per class of self.classes,
+        None for a class with TEXT units. The units are returned separated by class, as parse_device_3
+        uses them. Compiled profiles are shared through the profile cache and must not be modified.
+        """
+        units = self.seperated_by_classes(profile['units'], 'unit')
+        layouts = {}
+        for class_name in self.classes:
+            try:
+                layouts[class_name] = self.compile_class_layout(units[class_name])
+            except ValueError:
+                layouts[class_name] = None  # TEXT units, only decode_content can decode this class
+        return {
+            "model": profile["model"],
+            "profileVersion": profile["profileVersion"],
+            "voxpVersion": profile["voxpVersion"],
+            "textEncoding": profile["textEncoding"],
+            "units": units,
+            "layouts": layouts
+        }
+
+    def decode_messages(self, layout: dict, hex_messages: list[str]):
+        """
+        Decode many <data> payloads of one class in bulk, one record per message.
+        The payloads are cut or padded with zeros to the record size and converted with a single
+        bytes.fromhex call; the bytes are read in place with the raw layout, then converted and scaled
+        one field at a time for all the messages.
+        Returns a NumPy structured array with one field per unit ID.
+        """
+        if layout is None:
+            raise ValueError("Cannot decode in bulk a class with TEXT units")
+        width = layout['raw'].itemsize * 2
+        decoded = np.zeros(len(hex_messages), dtype=layout['decoded'])
+        if not width:
+            return decoded
+        payload = bytes.fromhex(''.join(message[:width].ljust(width, '0') for message in hex_messages))
+        raw = np.frombuffer(payload, dtype=layout['raw'])
+        for name in layout['raw'].names:
+            decoded[name] = raw[name]
+        for name, scale in layout['scales'].items():
+            decoded[name] /= scale
+        return decoded
+
+    def parse_device_3_arrays(self, file_path: str):
+        """
+        Bulk version of parse_device_3: every <data> message of the file decoded with the compiled profile.
+        Returns a dictionary of class name to structured array, one record per message in file order.
+        """
+        data = self.read_from_file(file_path=file_path)
+        packages = self.split_by_newlines(data=data)
+        profile = next(package for package in packages if package.startswith('<profile'))
+        layouts = self.profile_cache.get(profile)['layouts']
+        datas = self.seperated_by_classes([self.parse_data(package) for package in packages if not package.startswith('<profile')], 'data')
+        return {
+            class_name: self.decode_messages(layouts[class_name], [data['hex_data'] for data in datas[class_name]])
+            for class_name in self.classes
+        }
+
+    def iter_device_3(self, chunks, verify_crc: bool = True):
+        """
+        Streaming version of parse_device_3: consumes an iterable of bytes chunks (a file, a socket, a pipe)
+        and yields the ('profile', ...), ('data', ...) and ('crc_error', ...) events of Device3Stream.
+
+        Usage:
+            for event, value in parser.iter_device_3(parser.read_chunks('device_3.txt')): ...
+        """
+        stream = Device3Stream(self, verify_crc=verify_crc)
+        for chunk in chunks:
+            yield from stream.feed(chunk)
+        yield from stream.close()
+
 # parser = PacketParser()
 # parser.parse_device_3(file_path='Docs/Python Practice/device_3.txt')
 # values = {"setting": parser.setting, "monitor": parser.monitor, "alarm": parser.alarm}
@@ -2,12 +2,19 @@ from fastapi import FastAPI, Depends, HTTPException, status, Body
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from typing import Optional, List
 
 # Configuration
 PROMETHEUS_URL = "http://localhost:9090/api/v1/query"  # Adjust based on your Prometheus URL
 QUERY_FILE = "queries.json"  # File to store user-defined queries
+PROMETHEUS_TIMEOUT = (5, 30)  # Connect and read timeouts in seconds
+
+# Pooled keep-alive session shared by every endpoint, retrying transient failures with backoff
+prometheus_session = requests.Session()
+prometheus_session.mount("http://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504])))
 
 # FastAPI instance
 app = FastAPI()
@@ -73,7 +80,7 @@ async def query_prometheus(query_name: str, user: str = Depends(get_current_user
         raise HTTPException(status_code=404, detail="Query not found")
 
     # Send the query to Prometheus
-    response = requests.get(PROMETHEUS_URL, params={"query": query})
+    response = prometheus_session.get(PROMETHEUS_URL, params={"query": query}, timeout=PROMETHEUS_TIMEOUT)
     data = response.json()
 
     if data["status"] == "error":
@@ -109,7 +116,7 @@ async def system_activity(user: str = Depends(get_current_user)):
 @app.post("/custom-query", response_model=PrometheusQueryResponse)
 async def custom_query(query: str, user: str = Depends(get_current_user)):
     # Send custom query to Prometheus
-    response = requests.get(PROMETHEUS_URL, params={"query": query})
+    response = prometheus_session.get(PROMETHEUS_URL, params={"query": query}, timeout=PROMETHEUS_TIMEOUT)
     data = response.json()
 
     if data["status"] == "error":
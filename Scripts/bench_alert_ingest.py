@@ -0,0 +1,65 @@
+"""
+Benchmark of the alert webhook ingestion: the previous path (json decode, AlertGroup model validation,
+logging the model repr, echoing alert_group.dict()) against the current one (parse_alert_group with
+one decode and the alerts encoded once).
+
+Usage:
+    python Scripts/bench_alert_ingest.py [alerts per group] [rounds]
+"""
+import json, logging, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "monitoring-system", "API", "app"))
+from helper import AlertGroup
+from ingest import parse_alert_group, orjson
+
+def make_payload(count: int) -> bytes:
+    alerts = [{
+        "status": "firing",
+        "labels": {"alertname": "HighCPU", "instance": f"node_exporter_{i % 200}:9100", "severity": "critical", "job": "node_exporter"},
+        "annotations": {"summary": "CPU usage is above 90%", "description": f"node_exporter_{i % 200} is busy"},
+        "startsAt": "2024-12-01T00:00:00Z",
+        "endsAt": "0001-01-01T00:00:00Z",
+        "generatorURL": "http://prometheus:9090/graph?g0.expr=cpu",
+        "fingerprint": f"{i:016x}"
+    } for i in range(count)]
+    return json.dumps({
+        "receiver": "fastapi", "status": "firing", "alerts": alerts,
+        "groupLabels": {"alertname": "HighCPU"}, "commonLabels": {"alertname": "HighCPU"}, "commonAnnotations": {},
+        "externalURL": "http://alertmanager:9093", "version": "4", "groupKey": "{}:{alertname=\"HighCPU\"}", "truncatedAlerts": 0
+    }).encode()
+
+def previous_path(body: bytes):
+    payload = json.loads(body)
+    alert_group = AlertGroup(**payload)
+    logging.info(f"Received alert group: {alert_group}")
+    for alert in payload["alerts"]:
+        json.dumps(alert)  # send_json encoded every alert again for every client
+    return {"status": "Alert received", "data": alert_group.dict()}
+
+def current_path(body: bytes):
+    alert_group = parse_alert_group(body)
+    logging.info(f"Received alert group {alert_group.group_key} ({alert_group.status}) with {len(alert_group.alerts)} alerts")
+    for alert in alert_group.alerts:
+        _ = alert.encoded  # Timed on purpose: the lazy encoding done once per alert for all clients
+    return {"status": "Alert received", "alerts": len(alert_group.alerts)}
+
+def bench(name: str, function, body: bytes, count: int, rounds: int) -> float:
+    function(body)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        function(body)
+    elapsed = time.perf_counter() - started
+    rate = count * rounds / elapsed
+    print(f"{name:<10} {elapsed / rounds * 1000:10.2f} ms/group {rate:14,.0f} alerts/s")
+    return rate
+
+if __name__ == "__main__":
+    import warnings
+    warnings.filterwarnings("ignore")
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    body = make_payload(count)
+    print(f"{count} alerts per group, {rounds} rounds, {len(body) / 1024:.0f} KiB body, orjson {'enabled' if orjson else 'not installed'}")
+    before = bench("previous", previous_path, body, count, rounds)
+    after = bench("current", current_path, body, count, rounds)
+    print(f"speedup    {after / before:10.1f}x")
@@ -0,0 +1,194 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from timeutils import format_epoch
+
+ALERT_STORE_CAPACITY = int(os.environ.get("ALERT_STORE_CAPACITY", 10000))                  # Alerts kept at most
+ALERT_STORE_MAX_BYTES = int(os.environ.get("ALERT_STORE_MAX_BYTES", 64 * 1024 * 1024))     # Approximate JSON size kept at most
+INDEXED_FIELDS = ("fingerprint", "status", "instance", "severity")
+
+
+class StoredAlert:
+    """A single alert kept by the AlertStore, with the fields it is indexed on pulled out."""
+    __slots__ = ("id", "fingerprint", "status", "instance", "severity", "starts_at", "received_at", "repeats", "size", "alert", "group_key", "receiver")
+
+    def __init__(self, id: int, alert: dict, group_key: str, receiver: str, received_at: float, size: int = None):
+        labels = alert.get("labels") or {}
+        self.id = id
+        self.fingerprint = alert.get("fingerprint")
+        self.status = alert.get("status")
+        self.instance = labels.get("instance")
+        self.severity = labels.get("severity")
+        self.starts_at = alert.get("startsAt")
+        self.received_at = received_at
+        self.repeats = 0
+        self.alert = alert
+        self.group_key = group_key
+        self.receiver = receiver
+        self.size = size if size is not None else len(json.dumps(alert))
+
+    def dedup_key(self) -> tuple:
+        return (self.fingerprint, self.status, self.starts_at)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "received_at": format_epoch(self.received_at),
+            "repeats": self.repeats,
+            "group_key": self.group_key,
+            "receiver": self.receiver,
+            "alert": self.alert
+        }
+
+
+class AlertStore:
+    """
+    Bounded in-memory store of received alerts.
+
+    Alerts are kept in a ring buffer ordered by the time they were last received, bounded by a number of
+    alerts and an approximate byte budget; the oldest alerts are dropped first. Each alert is indexed by
+    `fingerprint`, `status`, `labels.instance` and `labels.severity`. A repeated notification for the same
+    fingerprint, status and start time is not stored again: the existing alert is updated, its repeat
+    counter increased and it moves to the newest end of the buffer.
+    """
+
+    def __init__(self, capacity: int = ALERT_STORE_CAPACITY, max_bytes: int = ALERT_STORE_MAX_BYTES):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evicted = 0
+        self.deduplicated = 0
+        self._next_id = 1
+        self._alerts: "OrderedDict[int, StoredAlert]" = OrderedDict()
+        self._by_dedup_key: Dict[tuple, int] = {}
+        self._indexes: Dict[str, Dict[str, Dict[int, None]]] = {field: {} for field in INDEXED_FIELDS}
+
+    def __len__(self):
+        return len(self._alerts)
+
+    def _index(self, stored: StoredAlert):
+        for field in INDEXED_FIELDS:
+            value = getattr(stored, field)
+            if value is not None:
+                self._indexes[field].setdefault(value, {})[stored.id] = None
+
+    def _unindex(self, stored: StoredAlert):
+        for field in INDEXED_FIELDS:
+            value = getattr(stored, field)
+            if value is not None:
+                ids = self._indexes[field][value]
+                del ids[stored.id]
+                if not ids:
+                    del self._indexes[field][value]
+
+    def _remove(self, id: int):
+        stored = self._alerts.pop(id)
+        self._unindex(stored)
+        self._by_dedup_key.pop(stored.dedup_key(), None)
+        self.bytes -= stored.size
+
+    def add(self, alert: dict, group_key: str = None, receiver: str = None, received_at: float = None, size: int = None) -> StoredAlert:
+        """
+        Store one alert (an element of the Alertmanager `alerts` list). `size` is the length of the
+        alert encoded as JSON when it is already known, it is computed otherwise.
+
+        Returns:
+            StoredAlert: The stored alert, which is the already stored one for a repeated notification.
+        """
+        received_at = received_at if received_at is not None else time.time()
+        stored = StoredAlert(self._next_id, alert, group_key, receiver, received_at, size)
+        existing_id = self._by_dedup_key.get(stored.dedup_key())
+        if existing_id is not None:
+            existing = self._alerts[existing_id]
+            self.bytes += stored.size - existing.size
+            existing.alert, existing.size = stored.alert, stored.size
+            existing.received_at = received_at
+            existing.repeats += 1
+            self._alerts.move_to_end(existing_id)
+            self.deduplicated += 1
+            return existing
+
+        self._next_id += 1
+        self._alerts[stored.id] = stored
+        self._by_dedup_key[stored.dedup_key()] = stored.id
+        self._index(stored)
+        self.bytes += stored.size
+        while len(self._alerts) > self.capacity or (self.bytes > self.max_bytes and len(self._alerts) > 1):
+            self._remove(next(iter(self._alerts)))
+            self.evicted += 1
+        return stored
+
+    def add_group(self, group: dict, received_at: float = None) -> List[StoredAlert]:
+        """Store every alert of an Alertmanager webhook payload."""
+        received_at = received_at if received_at is not None else time.time()
+        group_key, receiver = group.get("groupKey"), group.get("receiver")
+        return [self.add(alert, group_key, receiver, received_at) for alert in group.get("alerts", ())]
+
+    def query(
+        self,
+        fingerprint: str = None,
+        status: str = None,
+        instance: str = None,
+        severity: str = None,
+        since: float = None,
+        limit: Optional[int] = 100
+    ) -> List[StoredAlert]:
+        """
+        Find stored alerts, newest first.
+
+        Filters are combined with AND. Indexed filters are resolved by intersecting the index entries,
+        starting from the smallest; `since` (a unix timestamp compared to the last time the alert was
+        received) stops the scan as soon as an older alert is reached.
+        """
+        filters = {"fingerprint": fingerprint, "status": status, "instance": instance, "severity": severity}
+        candidates: List[Dict[int, None]] = []
+        for field, value in filters.items():
+            if value is None:
+                continue
+            ids = self._indexes[field].get(value)
+            if not ids:
+                return []
+            candidates.append(ids)
+
+        if candidates:
+            candidates.sort(key=len)
+            smallest, others = candidates[0], candidates[1:]
+            matches: Iterable[StoredAlert] = sorted(
+                (self._alerts[id] for id in smallest if all(id in other for other in others)),
+                key=lambda stored: stored.received_at,
+                reverse=True
+            )
+        else:
+            matches = (self._alerts[id] for id in reversed(self._alerts))
+
+        found = []
+        for stored in matches:
+            if (since is not None and stored.received_at < since) or (limit is not None and len(found) >= limit):
+                break
+            found.append(stored)
+        return found
+
+    def firing(self) -> Dict[str, dict]:
+        """
+        Alerts currently firing, keyed by fingerprint: the last received notification of every
+        fingerprint, when its status is 'firing'.
+        """
+        latest: Dict[str, StoredAlert] = {}
+        for id in self._indexes["status"].get("firing", ()):
+            stored = self._alerts[id]
+            other_ids = self._indexes["fingerprint"].get(stored.fingerprint, ())
+            if all(self._alerts[other].received_at <= stored.received_at for other in other_ids):
+                latest[stored.fingerprint] = stored
+        return {fingerprint: stored.alert for fingerprint, stored in latest.items()}
+
+    def stats(self) -> dict:
+        return {
+            "alerts": len(self._alerts),
+            "bytes": self.bytes,
+            "capacity": self.capacity,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted,
+            "deduplicated": self.deduplicated
+        }
@@ -0,0 +1,330 @@
+import asyncio
+import json
+import logging
+import os
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Callable
+from fastapi import WebSocket
+from subscriptions import Subscription, SubscriptionIndex
+
+CLIENT_QUEUE_SIZE = int(os.environ.get("WS_CLIENT_QUEUE_SIZE", 1000))   # Messages buffered per WebSocket client
+SLOW_CLIENT_POLICIES = ("drop_oldest", "disconnect")
+SLOW_CLIENT_POLICY = os.environ.get("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+MAX_BATCH_MS = 5000                                                     # Longest batching window a client may ask for
+REPLAY_LOG_SIZE = int(os.environ.get("WS_REPLAY_LOG_SIZE", 10000))      # Sequenced messages kept for reconnecting clients
+
+
+def with_seq(text: str, seq: int) -> str:
+    """Add a `seq` field to an encoded JSON object without decoding it again."""
+    body = text[1:]
+    return '{"seq":%d%s%s' % (seq, "," if body.lstrip() != "}" else "", body)
+
+
+class Subscriber:
+    """
+    One WebSocket client of the hub with its own bounded queue of encoded messages and a sender task
+    draining it, so a slow client only ever delays itself.
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self.task = None
+
+    def offer(self, text: str, key: str = None) -> bool:
+        """
+        Queue a message without waiting. When the queue is full the slow client policy applies:
+        'drop_oldest' discards the oldest queued message, 'disconnect' closes the client.
+
+        Returns:
+            bool: False if the client has to be disconnected.
+        """
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(text)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                return False
+            self.queue.get_nowait()
+            self.queue.put_nowait(text)
+            return True
+
+    async def run(self):
+        try:
+            while True:
+                text = await self.queue.get()
+                await self.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.info(f"WebSocket client send failed: {e}")
+        finally:
+            self.closed = True
+
+    def reply(self, text: str):
+        """Queue a direct reply to this client (e.g. the echo of a received message)."""
+        self.offer(text)
+
+    def queued(self) -> int:
+        return self.queue.qsize()
+
+
+class BatchingSubscriber(Subscriber):
+    """
+    A client receiving alerts in batches: messages arriving within `batch_ms` of the first one, or until
+    `batch_size` messages are pending, are sent as one JSON array frame. Pending messages with the same
+    key (the alert fingerprint) are collapsed to the latest one, so repeated updates of an alert during
+    a storm cost a single entry. The queue bound and slow client policy apply to pending messages.
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int, policy: str, batch_ms: int, batch_size: int):
+        super().__init__(websocket, queue_size, policy)
+        self.batch_ms = batch_ms
+        self.batch_size = min(batch_size, queue_size)
+        self.pending: "OrderedDict[object, str]" = OrderedDict()
+        self.replies = deque()
+        self.coalesced = 0
+        self._unkeyed = 0
+        self._ready = asyncio.Event()
+        self._full = asyncio.Event()
+
+    def offer(self, text: str, key: str = None) -> bool:
+        if self.closed:
+            return False
+        if key is None:
+            self._unkeyed += 1
+            key = ("unkeyed", self._unkeyed)
+        if key in self.pending:
+            self.coalesced += 1
+            del self.pending[key]
+        elif len(self.pending) >= self.queue.maxsize:
+            self.dropped += 1
+            if self.policy == "disconnect":
+                return False
+            self.pending.popitem(last=False)
+        self.pending[key] = text
+        self._ready.set()
+        if len(self.pending) >= self.batch_size:
+            self._full.set()
+        return True
+
+    def reply(self, text: str):
+        self.replies.append(text)
+        self._ready.set()
+
+    def queued(self) -> int:
+        return len(self.pending)
+
+    async def run(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self.replies:
+                    await self.websocket.send_text(self.replies.popleft())
+                if self.pending and not self._full.is_set():
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.batch_ms / 1000)
+                    except asyncio.TimeoutError:
+                        pass
+                if len(self.pending) <= self.batch_size:
+                    batch, self.pending = list(self.pending.values()), OrderedDict()
+                else:
+                    batch = [self.pending.popitem(last=False)[1] for _ in range(self.batch_size)]
+                if not self.pending and not self.replies:
+                    # Replies queued during the batch wait keep the event set
+                    self._ready.clear()
+                if len(self.pending) < self.batch_size:
+                    self._full.clear()
+                if batch:
+                    await self.websocket.send_text("[" + ",".join(batch) + "]")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.info(f"WebSocket client send failed: {e}")
+        finally:
+            self.closed = True
+
+
+class BroadcastHub:
+    """
+    Fan-out of messages to WebSocket clients.
+
+    `publish` only puts the message on the hub queue. A dispatcher task encodes every message once and
+    offers the same encoded text to the bounded queue of each client, and each client has a sender task
+    writing its queue to the socket. Clients that cannot keep up lose their oldest messages or are
+    disconnected, depending on the slow client policy.
+
+    Every JSON object message gets a monotonically increasing `seq` field and is kept in a bounded replay
+    log, so a reconnecting client can ask for everything after the last `seq` it saw. When that is no
+    longer in the log, it gets a snapshot from the `snapshot` callable (e.g. the currently firing alerts
+    keyed by fingerprint) instead, followed by the live messages.
+
+    Clients may subscribe with a filter (see subscriptions.Subscription); dict messages are then routed
+    through a SubscriptionIndex, so a message only costs work for the clients it can match.
+    """
+
+    def __init__(self, queue_size: int = CLIENT_QUEUE_SIZE, policy: str = SLOW_CLIENT_POLICY, replay_size: int = REPLAY_LOG_SIZE, snapshot: Callable[[], dict] = None):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Invalid slow client policy. Must be one of: {', '.join(SLOW_CLIENT_POLICIES)}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.subscribers = set()
+        self.index = SubscriptionIndex()
+        self.published = 0
+        self.disconnected = 0
+        self._dropped_by_closed = 0
+        self.seq = 0
+        self.replay = deque(maxlen=replay_size)
+        self.snapshot = snapshot
+        self.replayed = 0
+        self.snapshots = 0
+        self._queue = None
+        self._dispatcher = None
+
+    def _start(self):
+        if self._dispatcher is None:
+            self._queue = asyncio.Queue()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def register(self, websocket: WebSocket, batch_ms: int = None, batch_size: int = None, since_seq: int = None, subscription: Subscription = None) -> Subscriber:
+        """
+        Add an accepted WebSocket and start its sender task.
+
+        Args:
+            websocket (WebSocket): The accepted connection.
+            batch_ms (int, optional): Batch messages arriving within this many milliseconds into one frame.
+            batch_size (int, optional): Send a batch as soon as it holds this many messages.
+                Either option enables batching; the other one then defaults to 50ms or the queue size.
+            since_seq (int, optional): Last `seq` the client received before reconnecting; the messages after
+                it are replayed, or a snapshot is sent if they are not in the replay log anymore.
+            subscription (Subscription, optional): Only deliver the alerts matching this filter.
+        """
+        self._start()
+        if batch_ms is not None or batch_size is not None:
+            batch_ms = min(max(batch_ms if batch_ms is not None else 50, 0), MAX_BATCH_MS)
+            batch_size = max(batch_size if batch_size is not None else self.queue_size, 1)
+            subscriber = BatchingSubscriber(websocket, self.queue_size, self.policy, batch_ms, batch_size)
+        else:
+            subscriber = Subscriber(websocket, self.queue_size, self.policy)
+        self.index.add(subscriber, subscription)
+        if since_seq is not None:
+            self._catch_up(subscriber, since_seq)
+        subscriber.task = asyncio.create_task(subscriber.run())
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def _catch_up(self, subscriber: Subscriber, since_seq: int):
+        """
+        Queue what a reconnecting client missed. This runs before the client joins the fan-out and
+        without awaiting, so nothing is dispatched in between: no message is lost or sent twice.
+        """
+        if since_seq == self.seq:
+            return
+        if since_seq < self.seq and self.replay and self.replay[0][0] <= since_seq + 1:
+            for _, message, text, key in islice(self.replay, since_seq + 1 - self.replay[0][0], None):
+                if self.index.accepts(subscriber, message):
+                    subscriber.offer(text, key)
+                    self.replayed += 1
+            return
+        # The gap is older than the replay log (or the client saw a previous server run)
+        self.snapshots += 1
+        snapshot = self.snapshot() if self.snapshot is not None else {}
+        snapshot = {key: alert for key, alert in snapshot.items() if self.index.accepts(subscriber, alert)}
+        subscriber.reply(json.dumps({"type": "snapshot", "seq": self.seq, "alerts": snapshot}))
+
+    async def unregister(self, subscriber: Subscriber):
+        """Remove a client and stop its sender task."""
+        if subscriber in self.subscribers:
+            self._discard(subscriber)
+        subscriber.closed = True
+        if subscriber.task is not None and not subscriber.task.done():
+            subscriber.task.cancel()
+            try:
+                await subscriber.task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def publish(self, message, text: str = None, key: str = None, seq: int = None):
+        """
+        Queue a JSON-serializable message for every client. Never waits.
+
+        Args:
+            message: The message, encoded by the dispatcher unless `text` is given.
+            text (str, optional): The message already encoded as JSON.
+            key (str, optional): Key under which batching clients collapse repeated messages,
+                defaults to the `fingerprint` of a dict message.
+            seq (int, optional): Sequence number assigned elsewhere (by the shared state broker),
+                the next local number is used otherwise.
+        """
+        self._start()
+        self.published += 1
+        self._queue.put_nowait((message, text, key, seq))
+
+    def _discard(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        self.index.remove(subscriber)
+        self._dropped_by_closed += subscriber.dropped
+
+    def _fan_out(self, message, text: str, key: str = None):
+        targets = self.index.route(message) if isinstance(message, dict) else list(self.subscribers)
+        for subscriber in targets:
+            if not subscriber.offer(text, key):
+                self._discard(subscriber)
+                self.disconnected += 1
+                asyncio.create_task(self._close(subscriber))
+
+    async def _close(self, subscriber: Subscriber):
+        await self.unregister(subscriber)
+        try:
+            await subscriber.websocket.close(code=1013)  # Try again later
+        except Exception:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            message, text, key, seq = await self._queue.get()
+            if key is None and isinstance(message, dict):
+                key = message.get("fingerprint")
+            text = text if text is not None else json.dumps(message)
+            if text.startswith("{"):
+                if seq is None:
+                    seq = self.seq + 1
+                elif seq != self.seq + 1:
+                    # Messages are missing or numbering restarted, the log cannot serve replays across the gap
+                    self.replay.clear()
+                self.seq = seq
+                text = with_seq(text, self.seq)
+                self.replay.append((self.seq, message, text, key))
+            self._fan_out(message, text, key)
+            # Let the sender tasks drain their queues between messages of a burst
+            await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self.subscribers),
+            "filtered_clients": len(self.subscribers) - len(self.index.unfiltered),
+            "published": self.published,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "disconnected": self.disconnected,
+            "max_client_queue": max((subscriber.queued() for subscriber in self.subscribers), default=0),
+            "dropped": self._dropped_by_closed + sum(subscriber.dropped for subscriber in self.subscribers),
+            "coalesced": sum(getattr(subscriber, "coalesced", 0) for subscriber in self.subscribers),
+            "seq": self.seq,
+            "replay_log": len(self.replay),
+            "replayed": self.replayed,
+            "snapshots": self.snapshots
+        }
+
+    async def close(self):
+        for subscriber in list(self.subscribers):
+            await self.unregister(subscriber)
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
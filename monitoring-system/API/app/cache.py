@@ -0,0 +1,266 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 256 * 1024 * 1024   # Approximate size of the cached series
+CACHE_TTL = 600                       # Seconds an entry is served before it is fetched again
+CACHE_MUTABLE_WINDOW = 60             # Seconds before now that are never cached, samples may still arrive there
+SHARD_MAX_POINTS = 11000              # Prometheus refuses range queries of more points per series
+SHARD_CACHE_MAX_BYTES = int(os.environ.get("PROMETHEUS_SHARD_CACHE_BYTES", 128 * 1024 * 1024))   # 0 disables the shard cache
+
+_QUOTED = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`[^`]*`)""")
+_SPACES = re.compile(r"\s+")
+_SPACES_AROUND = re.compile(r"\s*([{}()\[\],=!~<>+\-*/^%])\s*")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a PromQL query for use as a cache key.
+    Whitespace outside of string literals is collapsed and removed around operators and brackets.
+    """
+    parts = _QUOTED.split(query.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = _SPACES_AROUND.sub(r"\1", _SPACES.sub(" ", parts[i]))
+    return "".join(parts)
+
+
+def align_range(start: float, end: float, step: int) -> Tuple[int, int]:
+    """Align a range to the step grid (multiples of `step` since the epoch) so overlapping windows share points."""
+    return int(start // step) * step, int(end // step) * step
+
+
+def shard_ranges(start: int, end: int, step: int, max_points: int = SHARD_MAX_POINTS) -> List[Tuple[int, int]]:
+    """
+    Split the aligned range [start, end] into sub-ranges of at most `max_points` steps.
+
+    Shard boundaries are multiples of `max_points * step` since the epoch rather than offsets from
+    `start`, so every window over the same period is cut the same way and whole shards can be reused.
+    """
+    span = max_points * step
+    shards = []
+    shard_start = start
+    while shard_start <= end:
+        shard_end = min((shard_start // span + 1) * span - step, end)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end + step
+    return shards
+
+
+def series_key(metric: dict) -> tuple:
+    return tuple(sorted(metric.items()))
+
+
+def result_size(result: List[dict]) -> int:
+    """Rough in-memory size of a Prometheus matrix result in bytes."""
+    size = 0
+    for series in result:
+        size += 64 + sum(len(k) + len(v) + 16 for k, v in series["metric"].items())
+        size += 48 * len(series.get("values", ()))
+    return size
+
+
+def slice_result(result: List[dict], start: float, end: float) -> List[dict]:
+    """Keep only the samples of a matrix result with start <= timestamp <= end, dropping empty series."""
+    sliced = []
+    for series in result:
+        values = [value for value in series["values"] if start <= value[0] <= end]
+        if values:
+            sliced.append({"metric": series["metric"], "values": values})
+    return sliced
+
+
+def stitch_results(*results: List[dict]) -> List[dict]:
+    """
+    Concatenate matrix results covering consecutive, non-overlapping ranges, given in time order.
+    Series are matched on their full label set; a series missing from some ranges is kept as is.
+    """
+    stitched: Dict[tuple, dict] = {}
+    for result in results:
+        for series in result:
+            key = series_key(series["metric"])
+            if key in stitched:
+                stitched[key]["values"].extend(series["values"])
+            else:
+                stitched[key] = {"metric": series["metric"], "values": list(series["values"])}
+    return list(stitched.values())
+
+
+class CacheEntry:
+    __slots__ = ("start", "end", "result", "size", "stored_at")
+
+    def __init__(self, start: int, end: int, result: List[dict], stored_at: float):
+        self.start = start
+        self.end = end
+        self.result = result
+        self.size = result_size(result)
+        self.stored_at = stored_at
+
+
+class QueryCache:
+    """
+    In-process LRU cache of Prometheus range query results with a TTL and a byte budget.
+
+    Entries are keyed on the normalized query and the step, and hold the step-aligned window
+    [start, end] they cover. A lookup returns the cached part of the requested window together with
+    the sub-ranges (at most one before and one after the cached window) that still have to be fetched.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL, mutable_window: float = CACHE_MUTABLE_WINDOW):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.mutable_window = mutable_window
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: tuple):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def lookup(self, query: str, start: int, end: int, step: int) -> Tuple[List[dict], List[Tuple[int, int]]]:
+        """
+        Look up an aligned range.
+
+        Returns:
+            tuple: The cached samples inside [start, end] and a list of (start, end) ranges to fetch.
+        """
+        key = (normalize_query(query), step)
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry.stored_at > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+        if entry is None or entry.end < start or entry.start > end:
+            self.misses += 1
+            return [], [(start, end)]
+
+        self._entries.move_to_end(key)
+        missing = []
+        if start < entry.start:
+            missing.append((start, entry.start - step))
+        if end > entry.end:
+            missing.append((entry.end + step, end))
+        if missing:
+            self.partial_hits += 1
+        else:
+            self.hits += 1
+        return slice_result(entry.result, start, end), missing
+
+    def store(self, query: str, start: int, end: int, step: int, result: List[dict]):
+        """
+        Store the samples of the aligned range [start, end], replacing the previous window of the query.
+        Samples newer than the mutable window are not stored. A window that extends the previous one
+        keeps its age, so the TTL still forces a full refetch of long-lived rolling windows.
+        """
+        cacheable_end = min(end, int((time.time() - self.mutable_window) // step) * step)
+        if cacheable_end < start:
+            return
+        if cacheable_end < end:
+            result = slice_result(result, start, cacheable_end)
+        key = (normalize_query(query), step)
+        stored_at = time.time()
+        previous = self._entries.get(key)
+        if previous is not None:
+            if previous.start <= cacheable_end and start <= previous.end:
+                stored_at = previous.stored_at
+            self._remove(key)
+        entry = CacheEntry(start, cacheable_end, result, stored_at)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+
+class ShardCache:
+    """
+    LRU cache of complete, immutable shards (see shard_ranges) of long range queries, bounded by bytes.
+
+    Only whole shards ending before the mutable window are stored; they never change, so they are kept
+    until evicted and let rolling windows refetch only the shards that are still filling up, even after
+    the QueryCache entry of the window expired. A partial shard is served by slicing the whole one.
+    """
+
+    def __init__(self, max_bytes: int = SHARD_CACHE_MAX_BYTES, max_points: int = SHARD_MAX_POINTS, mutable_window: float = CACHE_MUTABLE_WINDOW):
+        self.max_bytes = max_bytes
+        self.max_points = max_points
+        self.mutable_window = mutable_window
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _key(self, query: str, start: int, step: int) -> tuple:
+        span = self.max_points * step
+        return normalize_query(query), step, start - start % span
+
+    def get(self, query: str, start: int, end: int, step: int) -> Optional[List[dict]]:
+        """The samples of [start, end] (inside one shard) if its whole shard is cached, None otherwise."""
+        key = self._key(query, start, step)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.result if (entry.start, entry.end) == (start, end) else slice_result(entry.result, start, end)
+
+    def store(self, query: str, start: int, end: int, step: int, result: List[dict]):
+        """Keep the result of [start, end] if it is a whole shard that can no longer change."""
+        span = self.max_points * step
+        if start % span or end != start + span - step or end > time.time() - self.mutable_window:
+            return
+        entry = CacheEntry(start, end, result, time.time())
+        if entry.size > self.max_bytes:
+            return
+        key = self._key(query, start, step)
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key).size
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            self.bytes -= self._entries.popitem(last=False)[1].size
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,305 @@
+import asyncio
+import os
+import random
+import time
+import httpx
+from typing import Dict, List
+from helper import GRAFANA_API_URL, PROMETHEUS_API_URL
+from cache import QueryCache, ShardCache, SHARD_CACHE_MAX_BYTES, shard_ranges, stitch_results
+
+UPSTREAM_MAX_CONCURRENCY = 8        # Upper bound of requests in flight at once per upstream and API process
+UPSTREAM_CONNECT_TIMEOUT = 5.0      # Seconds
+UPSTREAM_TIMEOUT = 30.0             # Seconds, for reading the response
+UPSTREAM_RETRIES = 3                # Extra attempts after the first one
+UPSTREAM_BACKOFF = 0.2              # Seconds, doubled on every retry
+UPSTREAM_DEADLINE = 45.0            # Seconds, no retry starts after this much time spent on one request
+RETRY_STATUS_CODES = {502, 503, 504}
+# Failures before the request reached the upstream, safe and cheap to retry; a read timeout is not retried
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+SHARD_PARALLELISM = int(os.environ.get("PROMETHEUS_SHARD_PARALLELISM", 4))   # Shards of one long query fetched at once
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class UpstreamError(Exception):
+    """Raised when an upstream cannot be reached after all retries."""
+
+    def __init__(self, upstream: str, message: str):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.message = message
+
+
+class PrometheusQueryError(Exception):
+    """Raised when Prometheus answers a query with an error status."""
+
+    def __init__(self, status_code: int, message: str, payload: dict = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.payload = payload
+
+
+class UpstreamMetrics:
+    """
+    Request counters for one upstream: a cumulative latency histogram (Prometheus style buckets),
+    the number of requests currently in flight, and retry/error totals.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.latency_sum = 0.0
+        self.requests = 0
+        self.in_flight = 0
+        self.retries = 0
+        self.errors = 0
+        self.responses_by_status: Dict[int, int] = {}
+
+    def observe(self, seconds: float, status_code: int = None):
+        self.requests += 1
+        self.latency_sum += seconds
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+        if status_code is None:
+            self.errors += 1
+        else:
+            self.responses_by_status[status_code] = self.responses_by_status.get(status_code, 0) + 1
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "retries": self.retries,
+            "errors": self.errors,
+            "responses_by_status": dict(self.responses_by_status),
+            "latency_seconds": {
+                "sum": self.latency_sum,
+                "count": self.requests,
+                "buckets": {("+Inf" if bound == float("inf") else str(bound)): count for bound, count in zip(self.buckets, self.bucket_counts)}
+            }
+        }
+
+
+class UpstreamClient:
+    """
+    Async HTTP client for one upstream service sharing a pooled, keep-alive connection set.
+
+    Requests are bounded by a per-upstream semaphore, time out instead of hanging, and are retried
+    with exponential backoff on connection errors and 502/503/504 responses, as long as the request
+    stays within its overall deadline. The underlying
+    `httpx.AsyncClient` and semaphore are created lazily so they bind to the event loop that serves
+    the requests rather than the one active at import time.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+        timeout: float = UPSTREAM_TIMEOUT,
+        retries: int = UPSTREAM_RETRIES,
+        backoff: float = UPSTREAM_BACKOFF,
+        deadline: float = UPSTREAM_DEADLINE
+    ):
+        self.name = name
+        self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = deadline
+        self.metrics = UpstreamMetrics()
+        self._client = None
+        self._semaphore = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=UPSTREAM_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def get(self, path: str, params: dict = None) -> httpx.Response:
+        """
+        Send a GET request to the upstream, retrying transient failures.
+
+        Raises:
+            UpstreamError: If the upstream could not be reached after every retry, or the request failed
+                in a way that is not retried (e.g. a read timeout).
+        """
+        client = self.client
+        deadline = time.monotonic() + self.deadline
+        response = error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1) * (1 + random.random())
+                if time.monotonic() + delay >= deadline:
+                    break
+                self.metrics.retries += 1
+                await asyncio.sleep(delay)
+            async with self._semaphore:
+                self.metrics.in_flight += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params)
+                except httpx.TransportError as e:
+                    self.metrics.observe(time.perf_counter() - started)
+                    if not isinstance(e, RETRY_ERRORS):
+                        raise UpstreamError(self.name, f"{type(e).__name__}: {e}")
+                    error = e
+                    continue
+                finally:
+                    self.metrics.in_flight -= 1
+            self.metrics.observe(time.perf_counter() - started, response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.retries:
+                return response
+            error = None
+        # Out of time: answer with the last 502/503/504 response, or fail if the last attempt got none
+        if error is None:
+            return response
+        raise UpstreamError(self.name, f"{type(error).__name__}: {error}")
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+
+class PrometheusClient(UpstreamClient):
+    """Prometheus HTTP API client with cached, sharded range queries."""
+
+    def __init__(self, base_url: str = PROMETHEUS_API_URL, cache: QueryCache = None, shards: ShardCache = None, shard_parallelism: int = SHARD_PARALLELISM, **kwargs):
+        super().__init__("prometheus", base_url, **kwargs)
+        self.cache = cache
+        self.shards = shards
+        self.shard_parallelism = shard_parallelism
+        self.sharded_queries = 0
+
+    async def api(self, path: str, params=None):
+        """
+        Call a Prometheus HTTP API endpoint.
+
+        Raises:
+            PrometheusQueryError: If Prometheus does not answer with 200.
+
+        Returns:
+            The `data` member of the response.
+        """
+        response = await self.get(path, params=params)
+        if response.status_code != 200:
+            try:
+                payload = response.json()
+            except ValueError:
+                payload = None
+            raise PrometheusQueryError(response.status_code, response.text, payload)
+        return response.json()["data"]
+
+    async def fetch_range(self, query: str, start: int, end: int, step: int) -> List[dict]:
+        """
+        Run a single `/query_range` request, bypassing the cache.
+
+        Raises:
+            PrometheusQueryError: If Prometheus does not answer with 200.
+
+        Returns:
+            list: The `data.result` matrix.
+        """
+        data = await self.api("/query_range", params={"query": query, "start": start, "end": end, "step": f"{step}s"})
+        return data["result"]
+
+    async def fetch_sharded(self, query: str, start: int, end: int, step: int) -> List[dict]:
+        """
+        Run a range query of any length: the aligned range is split into shards within the Prometheus
+        points per series limit, fetched `shard_parallelism` at a time (whole historical shards come from
+        the shard cache) and stitched back in time order.
+
+        Raises:
+            PrometheusQueryError: If Prometheus does not answer one of the shards with 200.
+        """
+        ranges = shard_ranges(start, end, step)
+        if len(ranges) == 1 and self.shards is None:
+            return await self.fetch_range(query, start, end, step)
+        if len(ranges) > 1:
+            self.sharded_queries += 1
+        semaphore = asyncio.Semaphore(self.shard_parallelism)
+
+        async def fetch(shard_start: int, shard_end: int) -> List[dict]:
+            if self.shards is not None:
+                cached = self.shards.get(query, shard_start, shard_end, step)
+                if cached is not None:
+                    return cached
+            async with semaphore:
+                result = await self.fetch_range(query, shard_start, shard_end, step)
+            if self.shards is not None:
+                self.shards.store(query, shard_start, shard_end, step, result)
+            return result
+
+        parts = await asyncio.gather(*(fetch(shard_start, shard_end) for shard_start, shard_end in ranges))
+        return parts[0] if len(parts) == 1 else stitch_results(*parts)
+
+    async def query_range(self, query: str, start: int, end: int, step: int) -> List[dict]:
+        """
+        Run a range query over a step-aligned window, serving the part already cached and fetching
+        only the missing head and/or tail from Prometheus before stitching them together.
+
+        Args:
+            query (str): PromQL query.
+            start (int): Unix timestamp of the range start, aligned to `step`.
+            end (int): Unix timestamp of the range end, aligned to `step`.
+            step (int): Step duration in seconds.
+
+        Returns:
+            list: The `data.result` matrix for the whole window.
+        """
+        if self.cache is None:
+            return await self.fetch_sharded(query, start, end, step)
+        cached, missing = self.cache.lookup(query, start, end, step)
+        if not missing:
+            return cached
+        fetched = await asyncio.gather(*(self.fetch_sharded(query, fetch_start, fetch_end, step) for fetch_start, fetch_end in missing))
+        # A missing head always begins at `start`, a missing tail begins right after the cached window
+        head = [part for (fetch_start, _), part in zip(missing, fetched) if fetch_start == start]
+        tail = [part for (fetch_start, _), part in zip(missing, fetched) if fetch_start != start]
+        result = stitch_results(*head, cached, *tail)
+        self.cache.store(query, start, end, step, result)
+        return result
+
+    async def query_ranges(self, queries: Dict[str, str], start: int, end: int, step: int) -> Dict[str, List[dict]]:
+        """
+        Run several range queries over the same window concurrently.
+
+        Args:
+            queries (dict): Mapping of metric name to PromQL query.
+            start (int): Unix timestamp of the range start, aligned to `step`.
+            end (int): Unix timestamp of the range end, aligned to `step`.
+            step (int): Step duration in seconds.
+
+        Returns:
+            dict: Mapping of metric name to its `data.result` matrix, in the order of `queries`.
+        """
+        names = list(queries)
+        results = await asyncio.gather(*(self.query_range(queries[name], start, end, step) for name in names))
+        return dict(zip(names, results))
+
+
+query_cache = QueryCache()
+shard_cache = ShardCache() if SHARD_CACHE_MAX_BYTES > 0 else None
+prometheus = PrometheusClient(cache=query_cache, shards=shard_cache)
+grafana = UpstreamClient("grafana", GRAFANA_API_URL)
+upstreams = [prometheus, grafana]
+
+
+def upstream_metrics() -> dict:
+    """Snapshot of the request metrics of every upstream, keyed by upstream name."""
+    return {upstream.name: upstream.metrics.snapshot() for upstream in upstreams}
+
+
+async def close_upstreams():
+    for upstream in upstreams:
+        await upstream.aclose()
@@ -0,0 +1,108 @@
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+LTTB_PASSES = 2  # Passes of the vectorized LTTB; 2 keeps most of the points the sequential walk keeps at a fraction of its cost
+
+
+def bucket_edges(size: int, buckets: int) -> np.ndarray:
+    """Split `size` points into `buckets` contiguous, nearly equal buckets and return their boundaries."""
+    return np.linspace(0, size, buckets + 1).astype(np.int64)
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    The first and last points are always kept. The points in between are split into max_points - 2
+    buckets, and from each bucket the point forming the largest triangle with the point kept from the
+    previous bucket and the average of the next bucket is kept. Instead of walking the buckets one by
+    one, all buckets are solved at once in LTTB_PASSES passes: the first pass uses the average of the
+    previous bucket in place of its kept point, each further pass the point kept by the pass before.
+
+    Args:
+        x (np.ndarray): Ascending x values (timestamps).
+        y (np.ndarray): y values without NaN.
+        max_points (int): Number of points to keep, at least 3.
+
+    Returns:
+        np.ndarray: Sorted indices of the kept points.
+    """
+    size = len(x)
+    if size <= max_points or max_points < 3:
+        return np.arange(size)
+
+    buckets = max_points - 2
+    edges = bucket_edges(size - 2, buckets) + 1
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    # Averages of every bucket, plus the last point acting as the bucket after the last one
+    counts = np.diff(edges)
+    average_x = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / counts, x[-1])
+    average_y = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / counts, y[-1])
+
+    # Buckets as rows of a padded matrix; padding repeats the last point of the bucket and is masked out
+    index = edges[:-1, None] + np.arange(int(counts.max()))
+    inside = index < edges[1:, None]
+    index = np.where(inside, index, edges[1:, None] - 1)
+    bucket_x, bucket_y = x[index], y[index]
+    next_x, next_y = average_x[1:, None], average_y[1:, None]
+    previous_x = np.append(x[0], average_x[:-2])[:, None]
+    previous_y = np.append(y[0], average_y[:-2])[:, None]
+    for _ in range(LTTB_PASSES):
+        areas = np.abs(
+            (previous_x - next_x) * (bucket_y - previous_y)
+            - (previous_x - bucket_x) * (next_y - previous_y)
+        )
+        areas[~inside] = -1
+        selected = index[np.arange(buckets), areas.argmax(axis=1)]
+        previous_x = np.append(x[0], x[selected[:-1]])[:, None]
+        previous_y = np.append(y[0], y[selected[:-1]])[:, None]
+    return np.concatenate(([0], selected, [size - 1]))
+
+
+def minmax(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Min/max-per-bucket downsampling.
+
+    The points are split into (max_points - 2) // 2 buckets and the minimum and the maximum of each
+    bucket are kept, so short spikes and drops survive no matter how wide the bucket is. The first and
+    last points are always kept.
+
+    Args:
+        x (np.ndarray): Ascending x values (timestamps).
+        y (np.ndarray): y values without NaN.
+        max_points (int): Upper bound of points to keep, at least 4.
+
+    Returns:
+        np.ndarray: Sorted indices of the kept points.
+    """
+    size = len(y)
+    if size <= max_points or max_points < 4:
+        return np.arange(size)
+
+    buckets = (max_points - 2) // 2
+    edges = bucket_edges(size, buckets)
+    bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+    minimums = np.minimum.reduceat(y, edges[:-1])
+    maximums = np.maximum.reduceat(y, edges[:-1])
+    selected = [np.array([0, size - 1])]
+    for extremes in (minimums, maximums):
+        # First occurrence of the bucket extreme within each bucket
+        candidates = np.flatnonzero(y == extremes[bucket_of])
+        _, first = np.unique(bucket_of[candidates], return_index=True)
+        selected.append(candidates[first])
+    return np.unique(np.concatenate(selected))
+
+
+def downsample_indices(x: np.ndarray, y: np.ndarray, max_points: int, method: str = "lttb") -> np.ndarray:
+    """
+    Select at most `max_points` points of a series that may contain NaN gaps.
+    NaN and infinite samples are ignored; the returned indices refer to the original arrays.
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Invalid downsampling method. Must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+    valid = np.flatnonzero(np.isfinite(y))
+    if len(valid) <= max_points:
+        return valid
+    select = lttb if method == "lttb" else minmax
+    return valid[select(x[valid], y[valid], max_points)]
@@ -1,6 +1,5 @@
 # from keys import API_KEY
-import re
-from datetime import datetime, timedelta
+from datetime import datetime
 from pydantic import BaseModel, Field, root_validator
 from typing import Union, Any, Dict, List
 
@@ -64,6 +63,15 @@ metrics = {
     }
 }
 
+# Default metric set of /prometheus/device_info and /ws/metrics
+device_metrics = {
+    "up": "up",
+    "cpu_usage": "rate(node_cpu_seconds_total{mode!='idle'}[5m])",
+    "memory_available": "(node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes) * 100",
+    "disk_io": "rate(node_disk_io_time_seconds_total[5m])",
+    "network_errors": "rate(node_network_receive_errs_total[5m]) + rate(node_network_transmit_errs_total[5m])"
+}
+
 class Alert(BaseModel):
     status: str
     starts_at: datetime = Field(alias="startsAt")
@@ -118,39 +126,3 @@ def analyze_data(prometheus_data):
         if float(value) == 0:
             downtime_periods.append(timestamp)
     return {"downtime_periods": downtime_periods}
-
-def parse_relative_time(relative_time: str) -> datetime:
-    """Parse relative time like '10minute', '5hour', etc., and return the corresponding datetime."""
-    pattern = r"(\d+)(minute|hour|day|month|year)"
-    match = re.match(pattern, relative_time)
-
-    if not match:
-        raise ValueError("Invalid time format. Must be like '10minute', '5hour', etc.")
-
-    value, unit = match.groups()
-    value = int(value)
-
-    now = datetime.utcnow()
-
-    if unit == 'minute':
-        delta = timedelta(minutes=value)
-    elif unit == 'hour':
-        delta = timedelta(hours=value)
-    elif unit == 'day':
-        delta = timedelta(days=value)
-    elif unit == 'month':
-        delta = timedelta(days=30 * value)
-    elif unit == 'year':
-        delta = timedelta(days=365 * value)
-    else:
-        raise ValueError("Invalid period unit, must be one of: minute, hour, day, month, year")
-
-    return now - delta
-
-def iso_to_unix_timestamp(iso_timestamp: str) -> float:
-    dt = datetime.fromisoformat(iso_timestamp.replace("Z", "+00:00"))
-    unix_timestamp = dt.timestamp()
-    return unix_timestamp
-
-def format_date(date: float):
-    return datetime.fromtimestamp(int(float(date))).isoformat() + "Z"
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable, List
+
+try:
+    import orjson
+except ImportError:  # Standard library fallback, same results but slower
+    orjson = None
+
+INGEST_QUEUE_SIZE = int(os.environ.get("ALERT_QUEUE_SIZE", 10000))            # Alert groups waiting to be processed at most
+INGEST_WORKERS = int(os.environ.get("ALERT_WORKERS", 2))
+INGEST_OVERFLOW_POLICIES = ("reject", "drop_oldest")
+INGEST_OVERFLOW_POLICY = os.environ.get("ALERT_QUEUE_OVERFLOW", "reject")
+
+
+def loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def dumps(value) -> str:
+    return orjson.dumps(value).decode() if orjson is not None else json.dumps(value)
+
+
+class AlertRecord:
+    """
+    Lightweight view of one alert of an Alertmanager webhook payload.
+
+    The decoded dict is kept as is; the fields used by the API are read from it once, and anything
+    else (what `Alert.extra_fields` captures) is only collected when `extra_fields` is accessed.
+    """
+    __slots__ = ("raw", "status", "fingerprint", "labels", "starts_at", "_encoded")
+    FIELDS = frozenset(("status", "startsAt", "endsAt", "generatorURL", "annotations", "labels", "fingerprint"))
+
+    def __init__(self, raw: dict):
+        self.raw = raw
+        self.status = raw["status"]
+        self.fingerprint = raw["fingerprint"]
+        self.labels = raw["labels"]
+        self.starts_at = raw["startsAt"]
+        self._encoded = None
+
+    @property
+    def extra_fields(self) -> dict:
+        return {key: value for key, value in self.raw.items() if key not in self.FIELDS}
+
+    @property
+    def encoded(self) -> str:
+        """The alert encoded as JSON, computed once and shared by the store and the broadcast."""
+        if self._encoded is None:
+            self._encoded = dumps(self.raw)
+        return self._encoded
+
+
+class AlertGroupRecord:
+    """Lightweight view of an Alertmanager webhook payload, see AlertRecord."""
+    __slots__ = ("raw", "receiver", "status", "group_key", "alerts")
+    FIELDS = frozenset(("receiver", "status", "externalURL", "version", "groupKey", "truncatedAlerts",
+                        "groupLabels", "commonAnnotations", "commonLabels", "alerts"))
+
+    def __init__(self, raw: dict, alerts: List[AlertRecord]):
+        self.raw = raw
+        self.receiver = raw["receiver"]
+        self.status = raw["status"]
+        self.group_key = raw["groupKey"]
+        self.alerts = alerts
+
+    @property
+    def extra_fields(self) -> dict:
+        return {key: value for key, value in self.raw.items() if key not in self.FIELDS}
+
+
+def _require(container: dict, key: str, kind: type, where: str):
+    value = container.get(key)
+    if not isinstance(value, kind):
+        raise ValueError(f"{where}.{key} is required and must be of type {kind.__name__}")
+    return value
+
+
+def parse_alert_group(body: bytes) -> AlertGroupRecord:
+    """
+    Decode and minimally validate an Alertmanager webhook body in a single pass.
+
+    Only the fields the API relies on are checked (the same required fields as the AlertGroup and Alert
+    models); values are not copied or converted.
+
+    Raises:
+        ValueError: If the body is not valid JSON or a required field is missing or has the wrong type.
+    """
+    try:
+        raw = loads(body)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+    if not isinstance(raw, dict):
+        raise ValueError("The payload must be a JSON object")
+    for key in ("receiver", "status", "groupKey", "version", "externalURL"):
+        _require(raw, key, str, "payload")
+    for key in ("groupLabels", "commonLabels", "commonAnnotations"):
+        _require(raw, key, dict, "payload")
+    alerts = []
+    for i, alert in enumerate(_require(raw, "alerts", list, "payload")):
+        where = f"payload.alerts[{i}]"
+        if not isinstance(alert, dict):
+            raise ValueError(f"{where} must be an object")
+        for key in ("status", "startsAt", "endsAt", "generatorURL", "fingerprint"):
+            _require(alert, key, str, where)
+        for key in ("labels", "annotations"):
+            _require(alert, key, dict, where)
+        alerts.append(AlertRecord(alert))
+    return AlertGroupRecord(raw, alerts)
+
+
+class IngestionPipeline:
+    """
+    Bounded queue between the webhook endpoint and the alert processing (storage, broadcast, logging).
+
+    The endpoint only submits the parsed group; a pool of worker tasks calls `handler` for each one.
+    When the queue is full the overflow policy applies: 'reject' refuses the group (the endpoint answers
+    429 so Alertmanager retries later), 'drop_oldest' discards the oldest waiting group to make room.
+    """
+
+    def __init__(self, handler: Callable, max_size: int = INGEST_QUEUE_SIZE, workers: int = INGEST_WORKERS, policy: str = INGEST_OVERFLOW_POLICY):
+        if policy not in INGEST_OVERFLOW_POLICIES:
+            raise ValueError(f"Invalid overflow policy. Must be one of: {', '.join(INGEST_OVERFLOW_POLICIES)}")
+        self.handler = handler
+        self.max_size = max_size
+        self.workers = workers
+        self.policy = policy
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, item) -> bool:
+        """
+        Queue an item without waiting.
+
+        Returns:
+            bool: False if the queue is full and the item was rejected.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait((time.monotonic(), item))
+        except asyncio.QueueFull:
+            if self.policy == "reject":
+                self.rejected += 1
+                return False
+            self._queue.get_nowait()
+            self._queue.task_done()
+            self.dropped += 1
+            self._queue.put_nowait((time.monotonic(), item))
+        self.accepted += 1
+        return True
+
+    async def _work(self):
+        while True:
+            enqueued_at, item = await self._queue.get()
+            lag = time.monotonic() - enqueued_at
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            try:
+                result = self.handler(item)
+                if asyncio.iscoroutine(result):
+                    await result
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logging.exception(f"Processing queued alert group failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def drain(self):
+        """Wait until every queued item has been processed."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self, timeout: float = 5.0):
+        """Give the workers `timeout` seconds to process what is still queued, then stop them."""
+        try:
+            await asyncio.wait_for(self.drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Stopping alert ingestion with {self._queue.qsize()} alert groups still queued")
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        handled = self.processed + self.failed
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "workers": self.workers,
+            "overflow_policy": self.policy,
+            "accepted": self.accepted,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "lag_seconds": {
+                "last": self.last_lag,
+                "max": self.max_lag,
+                "average": self.total_lag / handled if handled else 0.0
+            }
+        }
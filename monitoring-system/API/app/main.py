@@ -1,23 +1,65 @@
-import requests, re, logging
+import asyncio, logging, json
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from datetime import datetime
+from fastapi import Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from helper import *
+from timeutils import parse_timestamp, parse_duration, resolve_step
+from merge import merge_results, downsample_series, encode_summaries, iter_summaries, ndjson_lines, json_array_chunks
+from downsample import DOWNSAMPLE_METHODS
+from clients import prometheus, grafana, query_cache, shard_cache, upstream_metrics, close_upstreams, UpstreamError, PrometheusQueryError
+from cache import align_range
+from rollups import UptimeRollups
+from alert_store import AlertStore
+from broadcast import BroadcastHub
+from subscriptions import Subscription, parse_matcher
+from ingest import parse_alert_group, AlertGroupRecord, IngestionPipeline
+from streams import MetricStreams
+from shared_state import create_backend
+from metadata import SeriesIndex
+from promql import inject_matcher, instance_matcher
 
 app = FastAPI()
+uptime_rollups = UptimeRollups(prometheus)
+metric_streams = MetricStreams(prometheus)
+series_index = SeriesIndex(prometheus)
+shared_state = create_backend()
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_tasks():
+    background_tasks.append(asyncio.create_task(uptime_rollups.run_periodically()))
+    background_tasks.append(asyncio.create_task(series_index.run_periodically()))
+    await shared_state.start(process_alert_group, lambda: alert_hub.seq)
+    ingestion.start()
+
+@app.on_event("shutdown")
+async def close_clients():
+    for task in background_tasks:
+        task.cancel()
+    await ingestion.stop()
+    await shared_state.stop()
+    await close_upstreams()
+    await alert_hub.close()
+    await metric_streams.close()
+    uptime_rollups.close()
+
+@app.exception_handler(UpstreamError)
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    return JSONResponse(status_code=502, content={"error": exc.message, "upstream": exc.upstream})
 
 @app.get("/grafana/dashboards", tags=["Grafana"])
-def get_dashboards():
+async def get_dashboards():
     """
     Fetch the list of Grafana dashboards.
 
     Returns:
         list: A list of Grafana dashboards in JSON format.
     """
-    response = requests.get(f"{GRAFANA_API_URL}/search")
+    response = await grafana.get("/search")
     return response.json()
 
 @app.get("/grafana/dashboard/{uid}", tags=["Grafana"])
-def get_dashboard_by_uid(uid: str):
+async def get_dashboard_by_uid(uid: str):
     """
     Fetch a Grafana dashboard by UID.
 
@@ -27,7 +69,7 @@ def get_dashboard_by_uid(uid: str):
     Returns:
         dict: JSON response with the dashboard details, including panels.
     """
-    response = requests.get(f"{GRAFANA_API_URL}/dashboards/uid/{uid}")
+    response = await grafana.get(f"/dashboards/uid/{uid}")
 
     if response.status_code == 200:
         return response.json()
@@ -35,177 +77,247 @@ def get_dashboard_by_uid(uid: str):
         return {"error": f"Dashboard with UID {uid} not found", "status_code": response.status_code}
 
 @app.get("/prometheus/query", tags=["Prometheus"])
-def query_prometheus(query: str = 'node_cpu_seconds_total{instance="node_exporter_2:9100"}', start: str = '2024-12-01T00:00:00Z', end: str = 'now', step: str = '60s'):
+async def query_prometheus(response: Response, query: str = 'node_cpu_seconds_total{instance="node_exporter_2:9100"}', start: str = '2024-12-01T00:00:00Z', end: str = 'now', step: str = '60s'):
     """
     Query Prometheus data using the provided query and optional time range.
 
     Args:
         query (str): PromQL query to fetch the metric data.
-        start (str, optional): Start time of the query in ISO format or relative time (e.g., '10minute').
-        end (str, optional): End time of the query in ISO format or relative time. Defaults to 'now'.
-        step (str, optional): Step duration between data points in Prometheus (e.g., '60s').
+        start (str, optional): Start time of the query, e.g. an RFC 3339 timestamp, 'now-6h' or '10minute'.
+        end (str, optional): End time of the query, same forms as start. Defaults to 'now'.
+        step (str, optional): Step duration between data points (e.g., '60s', '1h30m'), or 'auto'. Steps giving more
+            than MAX_POINTS_PER_SERIES points are raised; the step used is returned in the X-Query-Step header.
 
     Returns:
-        dict: The Prometheus query result in JSON format.
+        dict: The Prometheus range query result in JSON format. Results are served from the query cache
+            where possible, so only the part of the window not seen before is fetched from Prometheus.
     """
-    params = {"query": query}
-    if end == "now":
-        end = datetime.utcnow().isoformat() + "Z"
-    params.update({"start": start, "end": end, "step": step})
-    response = requests.get(f"{PROMETHEUS_API_URL}/query", params=params)
-    return response.json()
+    try:
+        start_timestamp = parse_timestamp(start)
+        end_timestamp = parse_timestamp(end)
+        step_seconds = resolve_step(start_timestamp, end_timestamp, step)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    response.headers["X-Query-Step"] = str(step_seconds)
+    start_timestamp, end_timestamp = align_range(start_timestamp, end_timestamp, step_seconds)
+    try:
+        result = await prometheus.query_range(query, start_timestamp, end_timestamp, step_seconds)
+    except PrometheusQueryError as e:
+        return e.payload if e.payload is not None else {"error": e.message}
+    return {"status": "success", "data": {"resultType": "matrix", "result": result}}
 
 @app.get("/prometheus/device_info", tags=["Prometheus"])
-def get_device_info(
+async def get_device_info(
+    response: Response,
     start: str = "30minute",
     end: str = "now",
     metrics: dict = None,
-    step: str = "60s"
+    step: str = "60s",
+    format: str = "json",
+    max_points: int = None,
+    downsample: str = "lttb",
+    instances: str = None
 ):
     """
     Fetch Prometheus data for specific device metrics over a time range.
 
     Args:
-        start (str, optional): Start time for the data query, in ISO format or relative time (e.g., '30minute').
+        start (str, optional): Start time for the data query, e.g. an RFC 3339 timestamp, 'now-6h', '30m' or '30minute'.
             Defaults to '30minute'.
-        end (str, optional): End time for the data query, in ISO format or relative time. Defaults to 'now'.
+        end (str, optional): End time for the data query, same forms as start. Defaults to 'now'.
         metrics (dict, optional): Dictionary of Prometheus queries to fetch various metrics. 
             Defaults to a predefined set of common system metrics.
-        step (str, optional): Step duration between data points in Prometheus, Seconds: s (e.g., 15s, 30s, 60s), Minutes: m (e.g., 1m, 5m, 10m), Hours: h (e.g., 1h, 6h, 12h), Days: d (e.g., 1d, 7d), Weeks: w (e.g., 1w, 2w). 
-            Defaults to '60s'.
+        step (str, optional): Step duration between data points as a PromQL duration, Seconds: s (e.g., 15s, 30s, 60s), Minutes: m (e.g., 1m, 5m, 10m), Hours: h (e.g., 1h, 6h, 12h), Days: d (e.g., 1d, 7d), Weeks: w (e.g., 1w, 2w),
+            or combined (e.g., 1h30m); 'auto' picks a round step for about 500 points. A step giving more than
+            MAX_POINTS_PER_SERIES points per series is raised to stay within the limit, the step used is returned
+            in the X-Query-Step header. Defaults to '60s'.
+        format (str, optional): Response encoding. 'json' returns the whole list at once, 'ndjson' streams one
+            device per line as newline-delimited JSON and 'json-stream' streams the same JSON array as 'json'
+            in chunks, one device at a time. Defaults to 'json'.
+        max_points (int, optional): Upper bound of points (timestamps) returned per device, across all its metrics.
+            Longer series are downsampled after merging; uptime is still computed from every step. Defaults to no limit.
+        downsample (str, optional): Downsampling method used with max_points, 'lttb' (Largest-Triangle-Three-Buckets,
+            keeps the visual shape) or 'minmax' (keeps the minimum and maximum of each bucket, so spikes survive).
+            Defaults to 'lttb'.
+        instances (str, optional): Comma separated instances to return (e.g., 'node_exporter_1:9100,node_exporter_2:9100').
+            The filter is added to the label matchers of every query, so Prometheus only returns those series.
+            Defaults to every instance.
 
     Returns:
         list: A list of devices with their metrics and uptime information.
     """
+    if format not in ("json", "ndjson", "json-stream"):
+        return {"error": "Invalid format. Must be one of: json, ndjson, json-stream"}
+    if downsample not in DOWNSAMPLE_METHODS:
+        return {"error": f"Invalid downsampling method. Must be one of: {', '.join(DOWNSAMPLE_METHODS)}"}
+    if max_points is not None and max_points < 4:
+        return {"error": "max_points must be at least 4"}
 
     try:
-        if re.match(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z", start):
-            start_time = start
-        else:
-            start_time = parse_relative_time(start).isoformat() + "Z"
+        start_time = parse_timestamp(start)
+        end_time = parse_timestamp(end)
+        step_timestamp = resolve_step(start_time, end_time, step)
     except ValueError as e:
         return {"error": str(e)}
 
-    if end == "now":
-        end_time = datetime.utcnow().isoformat() + "Z"
-    else:
-        try:
-            if re.match(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z", end):
-                end_time = end
-            else:
-                end_time = parse_relative_time(end).isoformat() + "Z"
-        except ValueError as e:
-            return {"error": str(e)}
-
-    start_timestamp = iso_to_unix_timestamp(start_time)
-    end_timestamp = iso_to_unix_timestamp(end_time)
-    
-    step_duration_format = step[-1]
-    step_timestamp = int(step[:-1])
-    if step_duration_format in ['s', 'm', 'h', 'd', 'w']:
-        if step_duration_format == 'm':
-            step_timestamp *= 60
-        elif step_duration_format == 'h':
-            step_timestamp *= 3600
-        elif step_duration_format == 'd':
-            step_timestamp *= 3600 * 24
-        elif step_duration_format == 'w':
-            step_timestamp *= 3600 * 24 * 7
-    else: raise ValueError("Invalid time format. Must be like '10s', '4w', '5d', etc.")
-
-    expected_data = (end_timestamp-start_timestamp)/step_timestamp
-    print(expected_data)
+    start_timestamp, end_timestamp = align_range(start_time, end_time, step_timestamp)
+    headers = {"X-Query-Step": str(step_timestamp)}
+    response.headers.update(headers)
 
     if metrics is None:
-        metrics = {
-            "up": "up",
-            "cpu_usage": "rate(node_cpu_seconds_total{mode!='idle'}[5m])",
-            "memory_available": "(node_memory_MemAvailable_bytes / node_memory_MemTotal_bytes) * 100",
-            "disk_io": "rate(node_disk_io_time_seconds_total[5m])",
-            "network_errors": "rate(node_network_receive_errs_total[5m]) + rate(node_network_transmit_errs_total[5m])"
-        }
-
-    instance_data = {}
-
-    for metric_name, query in metrics.items():
-        params = {
-            "query": query,
-            "start": start_time,
-            "end": end_time,
-            "step": f"{step_timestamp}s"
-        }
-
-        response = requests.get(f"{PROMETHEUS_API_URL}/query_range", params=params)
-        if response.status_code != 200:
-            return {"error": response.text}
-
-        data = response.json()
-        for result in data['data']['result']:
-            instance = result['metric']['instance']
-
-            if instance not in instance_data:
-                instance_data[instance] = {
-                    "metrics": {}
-                }
-
-            last_timestamp = None
-            for value in result['values']:
-                timestamp = value[0]
-                if last_timestamp is None:
-                    start_timestamp_follow = int(start_timestamp) + timestamp - int(timestamp)
-                    while start_timestamp_follow+step_timestamp < timestamp:
-                        start_timestamp_follow += step_timestamp
-                        # print(start_timestamp_follow)
-                        formatted_timestamp = format_date(start_timestamp_follow)
-                        if formatted_timestamp not in instance_data[instance]["metrics"]:
-                            instance_data[instance]["metrics"][formatted_timestamp] = {}
-                        instance_data[instance]["metrics"][formatted_timestamp]['up'] = "0"
-
-                while last_timestamp is not None and timestamp - step_timestamp != last_timestamp:
-                    last_timestamp += step_timestamp
-                    formatted_timestamp = format_date(last_timestamp)
-                    if formatted_timestamp not in instance_data[instance]["metrics"]:
-                        instance_data[instance]["metrics"][formatted_timestamp] = {}
-                    instance_data[instance]["metrics"][formatted_timestamp]['up'] = "0"
-
-                metric_value = value[1]
-                formatted_timestamp = format_date(timestamp)
-
-                if formatted_timestamp not in instance_data[instance]["metrics"]:
-                    instance_data[instance]["metrics"][formatted_timestamp] = {}
-
-                instance_data[instance]["metrics"][formatted_timestamp][metric_name] = metric_value
-                last_timestamp = timestamp
-
-    final_data = []
-    for instance, data in instance_data.items():
-        instance_summary = {
-            "instance": instance,
-            "metrics": []
-        }
-
-        for timestamp, metrics_at_time in sorted(data["metrics"].items()):
-            metrics_entry = {
-                "timestamp": timestamp
-            }
-            metrics_entry.update(metrics_at_time)
-            instance_summary["metrics"].append(metrics_entry)
-
-        if "up" in metrics_at_time:
-            uptime_data = [entry["up"] for entry in instance_summary["metrics"]]
-            total_time = len(uptime_data) * step_timestamp
-            uptime_time = sum([1 for entry in uptime_data if entry == "1"])
-            uptime_percentage = (uptime_time / len(uptime_data)) * 100 if len(uptime_data) > 0 else 0
-
-            instance_summary["uptime"] = {
-                "total_time_seconds": total_time,
-                "uptime_time_seconds": uptime_time * step_timestamp,
-                "uptime_percentage": uptime_percentage
-            }
-
-        final_data.append(instance_summary)
-
-    return final_data
+        metrics = device_metrics
+    if instances:
+        matcher = instance_matcher(instance.strip() for instance in instances.split(",") if instance.strip())
+        metrics = {name: inject_matcher(query, matcher) for name, query in metrics.items()}
+
+    try:
+        results = await prometheus.query_ranges(metrics, start_timestamp, end_timestamp, step_timestamp)
+    except PrometheusQueryError as e:
+        return {"error": e.message}
+
+    # Merging, downsampling and encoding are CPU bound and run in a worker thread, so the event loop
+    # (alerts, WebSockets) keeps running; the streaming formats are iterated in the thread pool as well
+    merged = await asyncio.to_thread(merge_results, results, start_timestamp, end_timestamp, step_timestamp)
+    del results
+    if max_points is not None:
+        await asyncio.to_thread(downsample_series, merged, max_points, downsample)
+    if format == "ndjson":
+        return StreamingResponse(ndjson_lines(iter_summaries(merged)), media_type="application/x-ndjson", headers=headers)
+    if format == "json-stream":
+        return StreamingResponse(json_array_chunks(iter_summaries(merged)), media_type="application/json", headers=headers)
+    return Response(await asyncio.to_thread(encode_summaries, merged), media_type="application/json", headers=headers)
+
+@app.get("/prometheus/uptime", tags=["Prometheus"])
+async def get_uptime(start: str = "30day", end: str = "now"):
+    """
+    Fetch the uptime (SLA) of every device over a time range.
+
+    Whole hours and days are answered from persisted hourly/daily rollups of the `up` metric, which are
+    extended incrementally from their last watermark; only the partial hours at both ends of the range
+    are queried from Prometheus.
+
+    Args:
+        start (str, optional): Start time, e.g. an RFC 3339 timestamp, 'now-30d' or '30day'. Defaults to '30day'.
+        end (str, optional): End time, same forms as start. Defaults to 'now'.
+
+    Returns:
+        list: A list of devices with their uptime information.
+    """
+    try:
+        start_timestamp = parse_timestamp(start)
+        end_timestamp = parse_timestamp(end)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    try:
+        return await uptime_rollups.uptime(start_timestamp, end_timestamp)
+    except PrometheusQueryError as e:
+        return {"error": e.message}
+
+@app.get("/metrics/upstreams", tags=["Monitoring"])
+def get_upstream_metrics():
+    """
+    Report request metrics of the upstream clients used by the API.
+
+    Returns:
+        dict: Per upstream (prometheus, grafana) request and retry counts, in-flight requests,
+            responses by status code and a cumulative latency histogram in seconds.
+    """
+    return upstream_metrics()
+
+@app.get("/metrics/cache", tags=["Monitoring"])
+def get_cache_metrics():
+    """
+    Report the state of the Prometheus query cache.
+
+    Returns:
+        dict: Entry count and size in bytes, hit/partial hit/miss counters and eviction/expiration counters,
+            plus the same counters for the shard cache of long queries and the number of sharded queries.
+    """
+    return {
+        **query_cache.stats(),
+        "shards": shard_cache.stats() if shard_cache is not None else None,
+        "sharded_queries": prometheus.sharded_queries
+    }
+
+@app.get("/devices", tags=["Devices"])
+async def get_devices(prefix: str = "", job: str = None):
+    """
+    List the monitored devices from the series metadata index, without querying any samples.
+
+    Args:
+        prefix (str, optional): Only instances starting with this prefix.
+        job (str, optional): Only instances scraped by this job.
+
+    Returns:
+        list: One entry per instance with its jobs and its number of metrics and series.
+    """
+    try:
+        await series_index.ensure_fresh()
+    except (PrometheusQueryError, UpstreamError) as e:
+        return {"error": getattr(e, "message", str(e))}
+    return series_index.devices(prefix, job)
+
+@app.get("/labels", tags=["Devices"])
+async def get_label_names(prefix: str = "", limit: int = 100):
+    """
+    Autocomplete label names from the series metadata index.
+
+    Args:
+        prefix (str, optional): Only names starting with this prefix.
+        limit (int, optional): Number of names returned at most. Defaults to 100.
+    """
+    try:
+        await series_index.ensure_fresh()
+    except (PrometheusQueryError, UpstreamError) as e:
+        return {"error": getattr(e, "message", str(e))}
+    return series_index.label_names(prefix, limit)
+
+@app.get("/labels/{name}/values", tags=["Devices"])
+async def get_label_values(request: Request, name: str, prefix: str = "", limit: int = 100):
+    """
+    Autocomplete the values of a label from the series metadata index.
+
+    Args:
+        name (str): Label name, e.g. 'instance' or 'job'.
+        prefix (str, optional): Only values starting with this prefix.
+        limit (int, optional): Number of values returned at most. Defaults to 100.
+
+    The values can be restricted to series having other labels with repeated `match` parameters,
+    e.g. `?match=job="node_exporter"`; only equality matchers are supported.
+    """
+    try:
+        matchers = [parse_matcher(text) for text in request.query_params.getlist("match")]
+    except ValueError as e:
+        return {"error": str(e)}
+    if any(matcher.op != "=" for matcher in matchers):
+        return {"error": "Only equality matchers (name=\"value\") are supported"}
+    try:
+        await series_index.ensure_fresh()
+    except (PrometheusQueryError, UpstreamError) as e:
+        return {"error": getattr(e, "message", str(e))}
+    return series_index.label_values(name, prefix, {matcher.name: matcher.value for matcher in matchers}, limit)
+
+@app.get("/metrics/metadata", tags=["Monitoring"])
+def get_metadata_metrics():
+    """
+    Report the state of the series metadata index behind `/devices` and `/labels`.
+
+    Returns:
+        dict: Indexed series, label and device counts, the last refresh time and refresh/failure counters.
+    """
+    return series_index.stats()
+
+@app.get("/metrics/streams", tags=["Monitoring"])
+def get_stream_metrics():
+    """
+    Report the shared pollers behind `/ws/metrics`.
+
+    Returns:
+        list: One entry per distinct metric set and step with its client count and poll/update/failure counters.
+    """
+    return metric_streams.stats()
 
 @app.get("/")
 def root():
@@ -214,52 +326,133 @@ def root():
         "endpoints": {
             "/grafana/dashboards": "Fetch the list of Grafana dashboards.",
             "/prometheus/query": "Query Prometheus data with optional time range.",
-            "/prometheus/device_info": "Fetch Prometheus data for specific device metrics over a time range."
+            "/prometheus/device_info": "Fetch Prometheus data for specific device metrics over a time range.",
+            "/prometheus/uptime": "Fetch the uptime (SLA) of every device over a time range from persisted rollups.",
+            "/metrics/upstreams": "Request metrics of the API's Prometheus and Grafana clients.",
+            "/metrics/cache": "Hit, miss and eviction counters of the Prometheus query cache.",
+            "/metrics/streams": "Clients and poll counters of the live metric streams.",
+            "/metrics/metadata": "Size and refresh counters of the series metadata index.",
+            "/devices": "List the monitored devices from the series metadata index.",
+            "/labels": "Autocomplete label names and, under /labels/{name}/values, label values.",
+            "/alerts": "Query received alerts by instance, status, severity, fingerprint and time.",
+            "/metrics/alerts": "Size and eviction counters of the alert store."
         },
         "note": "For detailed information on each endpoint, refer to the documentation: github.com/elymsyr/internship-ordinatrum"
     }
 
-alerts = []
-active_connections = []
+alert_store = AlertStore()
+alert_hub = BroadcastHub(snapshot=alert_store.firing)
+
+def process_alert_group(alert_group: AlertGroupRecord, first_seq: int = None):
+    """
+    Log, store and broadcast a received alert group. Called through the shared state backend for every
+    group received by any worker process; `first_seq` is the sequence number of its first alert when the
+    backend assigns them.
+    """
+    logging.info(f"Received alert group {alert_group.group_key} ({alert_group.status}) with {len(alert_group.alerts)} alerts")
+
+    # Store the alerts, repeated notifications of an already stored alert are deduplicated
+    group_key, receiver = alert_group.group_key, alert_group.receiver
+    for alert in alert_group.alerts:
+        alert_store.add(alert.raw, group_key, receiver, size=len(alert.encoded))
+
+    # Queue the alerts for all connected WebSocket clients, sending happens in the background
+    for i, alert in enumerate(alert_group.alerts):
+        alert_hub.publish(alert.raw, text=alert.encoded, key=alert.fingerprint, seq=first_seq + i if first_seq is not None else None)
+
+ingestion = IngestionPipeline(shared_state.publish)
 
 @app.post("/alerts/jobs", tags=["Alerts"])
 async def receive_alert(request: Request):
     """
     Endpoint to receive an alert group via a POST request.
     
-    This endpoint parses and validates the incoming JSON payload using the AlertGroup model,
-    logs the received data, appends it to the alert list, and broadcasts it to all active WebSocket
-    clients.
+    This endpoint decodes the incoming JSON payload once, checks the fields required by the AlertGroup
+    and Alert models and queues it. Ingestion workers then log a short summary, store its alerts in the
+    alert store and broadcast them to all active WebSocket clients, so Alertmanager gets its answer
+    without waiting for any of that. Each alert is encoded once and shared by the store and the broadcast.
 
-    - **alert_group**: A validated `AlertGroup` model containing the alert information.
+    - **alert_group**: An Alertmanager webhook payload, see the `AlertGroup` model.
     
     **Returns:**
-    - A JSON response indicating the status and the alert group data.
+    - A JSON response indicating the status and the number of alerts received, 422 if the payload is invalid,
+      or 429 if the ingestion queue is full and the overflow policy is 'reject'.
     """
-    # Parse and validate the incoming JSON data using the AlertGroup model
-    payload = await request.json()
-    alert_group = AlertGroup(**payload)  # Use Pydantic to validate and parse the data
+    try:
+        alert_group = parse_alert_group(await request.body())
+    except ValueError as e:
+        return JSONResponse(status_code=422, content={"error": str(e)})
 
-    # Log the received alert payload
-    logging.info(f"Received alert group: {alert_group}")
+    if not ingestion.submit(alert_group):
+        return JSONResponse(status_code=429, content={"error": "Alert queue is full"}, headers={"Retry-After": "1"})
 
-    # Append the parsed alert group to the alerts list
-    alerts.append(alert_group)
+    return {"status": "Alert received", "alerts": len(alert_group.alerts)}
 
-    # Send the alert to all connected WebSocket clients
-    for connection in active_connections:
-        for alert in payload['alerts']:
-            await connection.send_json(alert)
-    
-    return {"status": "Alert received", "data": alert_group.dict()}
+@app.get("/alerts", tags=["Alerts"])
+def get_alerts(
+    instance: str = None,
+    status: str = None,
+    severity: str = None,
+    fingerprint: str = None,
+    since: str = None,
+    limit: int = 100
+):
+    """
+    Query the received alerts, newest first.
+
+    Args:
+        instance (str, optional): Only alerts with this `labels.instance`.
+        status (str, optional): Only alerts with this status ('firing' or 'resolved').
+        severity (str, optional): Only alerts with this `labels.severity`.
+        fingerprint (str, optional): Only alerts with this fingerprint.
+        since (str, optional): Only alerts received since this time, e.g. an RFC 3339 timestamp, 'now-10m' or '10minute'.
+        limit (int, optional): Maximum number of alerts returned. Defaults to 100.
+
+    Returns:
+        list: The matching alerts with the time they were last received and how often they were repeated.
+    """
+    try:
+        since_timestamp = parse_timestamp(since) if since is not None else None
+    except ValueError as e:
+        return {"error": str(e)}
+    found = alert_store.query(fingerprint=fingerprint, status=status, instance=instance, severity=severity, since=since_timestamp, limit=limit)
+    return [stored.to_dict() for stored in found]
+
+@app.get("/metrics/alerts", tags=["Monitoring"])
+def get_alert_store_metrics():
+    """
+    Report the state of the alert store, the ingestion queue and the WebSocket broadcast.
+
+    Returns:
+        dict: Stored alert count and size in bytes, limits, evicted and deduplicated alert counters,
+            the ingestion queue depth, lag and overflow counters, and the connected clients, queued,
+            dropped and disconnected counts of the broadcast.
+    """
+    return {**alert_store.stats(), "ingestion": ingestion.stats(), "broadcast": alert_hub.stats(), "shared_state": shared_state.stats()}
 
 @app.websocket("/ws/alerts")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, batch_ms: int = None, batch_size: int = None, since_seq: int = None, status: str = None, severity: str = None, instance: str = None):
     """
     WebSocket endpoint for receiving and sending messages related to alerts.
     
     This endpoint allows clients to establish a WebSocket connection and receive updates whenever
     a new alert is received. It also sends back any text data received from the client.
+    Each client has its own bounded send queue, so a slow client never delays the webhook or other clients;
+    when its queue is full it loses its oldest messages or is disconnected (`WS_SLOW_CLIENT_POLICY`).
+
+    Batching mode: connecting with `?batch_ms=50` and/or `?batch_size=500` makes the server collect the
+    alerts arriving within the window (or until the size is reached) and send them as one JSON array frame.
+    Repeated updates of the same alert (by `fingerprint`) within a batch are collapsed to the latest one.
+
+    Reconnecting: every alert carries a `seq` field. Reconnecting with `?since_seq=<last seq received>`
+    first sends the alerts published since then. When they are older than the replay log
+    (`WS_REPLAY_LOG_SIZE`) or the server was restarted, a `{"type": "snapshot", "seq": ..., "alerts": {...}}`
+    message with the currently firing alerts keyed by fingerprint is sent instead.
+
+    Filters: `?status=firing`, `?severity=critical,warning`, `?instance=node_exporter:9100` and repeated
+    `?match=<matcher>` label matchers (`job="node_exporter"`, `instance=~"node.*"`, `severity!="info"`)
+    restrict the alerts sent to the client; all of them must match. An invalid matcher rejects the
+    connection with code 1008.
 
     - Clients can use this endpoint to receive alerts in real-time as they are posted to the `/alerts/jobs` endpoint.
 
@@ -269,11 +462,59 @@ async def websocket_endpoint(websocket: WebSocket):
     
     The WebSocket connection is maintained until the client disconnects.
     """
+    try:
+        subscription = Subscription.from_params(websocket.query_params.getlist("match"), status=status, severity=severity, instance=instance)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
     await websocket.accept()
-    active_connections.append(websocket)
+    subscriber = alert_hub.register(websocket, batch_ms=batch_ms, batch_size=batch_size, since_seq=since_seq, subscription=subscription)
     try:
         while True:
             data = await websocket.receive_text()
-            await websocket.send_text(f"Message text: {data}")
+            subscriber.reply(f"Message text: {data}")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await alert_hub.unregister(subscriber)
+
+@app.websocket("/ws/metrics")
+async def metrics_websocket(websocket: WebSocket, window: str = "30minute", step: str = "60s", metrics: str = None):
+    """
+    WebSocket endpoint streaming device metrics live.
+
+    On connect the client receives `{"type": "snapshot", "step": ..., "devices": [...]}` with the last `window`
+    of data in the `/prometheus/device_info` format. Afterwards, every time new steps are complete the server
+    sends `{"type": "update", "devices": [{"instance": ..., "metrics": [...]}]}` holding only the new points.
+    Clients asking for the same metrics and step share one poller, so the upstream load does not grow with
+    the number of viewers.
+
+    Args:
+        window (str, optional): Length of the initial window as a duration (e.g., '30m', '1h30m', '30minute'). Defaults to '30minute'.
+        step (str, optional): Step duration between data points, same forms as `/prometheus/device_info` ('auto' included). Defaults to '60s'.
+        metrics (str, optional): JSON object mapping metric names to PromQL queries. Defaults to the device_info metrics.
+
+    Invalid parameters close the connection with code 1008; a failed initial query with code 1011.
+    """
+    try:
+        window_seconds = parse_duration(window)
+        step_seconds = resolve_step(0, window_seconds, step)
+        queries = json.loads(metrics) if metrics is not None else device_metrics
+        if not isinstance(queries, dict) or not queries or not all(isinstance(query, str) for query in queries.values()):
+            raise ValueError("metrics must be a JSON object mapping metric names to PromQL queries")
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    await websocket.accept()
+    try:
+        poller, subscriber = await metric_streams.subscribe(websocket, queries, step_seconds, max(int(window_seconds), 0))
+    except (PrometheusQueryError, UpstreamError) as e:
+        await websocket.close(code=1011, reason=getattr(e, "message", str(e))[:120])
+        return
+    try:
+        while True:
+            await websocket.receive_text()
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
\ No newline at end of file
+        pass
+    finally:
+        await metric_streams.unsubscribe(poller, subscriber)
\ No newline at end of file
@@ -0,0 +1,249 @@
+import json
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, Optional
+from downsample import bucket_edges, downsample_indices
+from timeutils import format_epochs
+
+try:
+    import orjson
+except ImportError:  # Standard library fallback, same results but slower
+    orjson = None
+
+MIN_POINTS = 4  # Fewest points per column the downsampling methods work with
+
+
+class MergedSeries:
+    """
+    Columnar view of every metric collected for a single instance.
+
+    Timestamps are kept as an int64 array of unix seconds aligned to the step grid,
+    and each metric is a float64 column of the same length. Missing samples are NaN,
+    except for the `up` column where a gap means the target was down (0).
+    """
+    __slots__ = ("instance", "timestamps", "columns", "step", "_uptime")
+
+    def __init__(self, instance: str, timestamps: np.ndarray, columns: Dict[str, np.ndarray], step: int):
+        self.instance = instance
+        self.timestamps = timestamps
+        self.columns = columns
+        self.step = step
+        self._uptime = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def uptime(self) -> Optional[dict]:
+        """
+        Compute the uptime block from the `up` column.
+
+        The result is kept, so it still describes the full resolution series after downsampling.
+
+        Returns:
+            dict: Total, up time in seconds and the uptime percentage, or None if `up` was not queried.
+        """
+        if self._uptime is not None:
+            return self._uptime
+        up = self.columns.get("up")
+        if up is None:
+            return None
+        total = len(up)
+        up_count = int(np.count_nonzero(up == 1))
+        self._uptime = {
+            "total_time_seconds": total * self.step,
+            "uptime_time_seconds": up_count * self.step,
+            "uptime_percentage": (up_count / total) * 100 if total > 0 else 0
+        }
+        return self._uptime
+
+    def downsample(self, max_points: int, method: str = "lttb"):
+        """
+        Reduce the series to at most `max_points` rows with the given method ('lttb' or 'minmax').
+
+        Points are selected per column and the series keeps the union of the selected timestamps; the
+        cells a column did not select become NaN. Columns rarely select the same timestamps, so every
+        column gets an equal share of `max_points`. The uptime block is computed beforehand from the
+        full `up` column.
+        """
+        if len(self.timestamps) <= max_points:
+            return
+        self.uptime()
+        x = self.timestamps
+        budget = max(MIN_POINTS, max_points // max(len(self.columns), 1))
+        selected = {name: downsample_indices(x, column, budget, method) for name, column in self.columns.items()}
+        rows = np.unique(np.concatenate(list(selected.values()))) if selected else np.arange(0)
+        if len(rows) > max_points:
+            # More columns than MIN_POINTS each can fit: keep evenly spaced rows of the union
+            rows = rows[bucket_edges(len(rows), max_points)[:-1]]
+            selected = {name: indices[np.isin(indices, rows)] for name, indices in selected.items()}
+        columns = {}
+        for name, indices in selected.items():
+            column = np.full(len(rows), np.nan)
+            column[np.searchsorted(rows, indices)] = self.columns[name][indices]
+            columns[name] = column
+        self.timestamps = x[rows]
+        self.columns = columns
+
+    def to_records(self) -> List[dict]:
+        """
+        Serialize the columns into the row-oriented `metrics` list of the device_info response.
+        Timestamps are formatted here, once per row, and NaN cells are left out of the row.
+        Infinite samples ("+Inf"/"-Inf" from Prometheus) become None, since JSON has no infinity.
+        """
+        formatted = format_epochs(self.timestamps)
+        names = list(self.columns)
+        values = []
+        for name in names:
+            column = self.columns[name]
+            cells = column.tolist()
+            for index in np.flatnonzero(np.isinf(column)).tolist():
+                cells[index] = None
+            values.append(cells)
+        records = []
+        for row, timestamp in enumerate(formatted):
+            entry = {"timestamp": timestamp}
+            for name, column in zip(names, values):
+                value = column[row]
+                if value == value:  # skip NaN, keep None
+                    entry[name] = value
+            records.append(entry)
+        return records
+
+    def summary(self) -> dict:
+        """Build the per-instance summary returned by `/prometheus/device_info`."""
+        instance_summary = {
+            "instance": self.instance,
+            "metrics": self.to_records()
+        }
+        uptime = self.uptime()
+        if uptime is not None:
+            instance_summary["uptime"] = uptime
+        return instance_summary
+
+
+def grid_size(start: float, end: float, step: int) -> int:
+    """Number of points Prometheus evaluates for a range query between start and end."""
+    if end < start:
+        return 0
+    return int((end - start) // step) + 1
+
+
+def sample_arrays(values: list):
+    """
+    Convert a Prometheus `values` list of [timestamp, "value"] pairs into two arrays.
+
+    Returns:
+        tuple: float64 timestamps and float64 values (Prometheus strings such as "NaN" or "+Inf" included).
+    """
+    count = len(values)
+    timestamps = np.fromiter((value[0] for value in values), dtype=np.float64, count=count)
+    samples = np.array([value[1] for value in values], dtype=np.float64)
+    return timestamps, samples
+
+
+def merge_results(results: Dict[str, list], start: float, end: float, step: int) -> Dict[str, MergedSeries]:
+    """
+    Merge the `data.result` lists of several range queries into one columnar series per instance.
+
+    Every sample is placed on the step grid starting at `start`. Rows run from the grid start to the
+    last step where the instance reported anything; gaps in `up` inside that span are filled with 0
+    and gaps in other metrics stay NaN. When a query returns several series for the same instance,
+    later series overwrite earlier ones on the same step.
+
+    Args:
+        results (dict): Mapping of metric name to the Prometheus `data.result` list for that metric.
+        start (float): Unix timestamp of the range start.
+        end (float): Unix timestamp of the range end.
+        step (int): Step duration in seconds.
+
+    Returns:
+        dict: Mapping of instance name to its MergedSeries, in first-seen order.
+    """
+    size = grid_size(start, end, step)
+    grid = int(start) + np.arange(size, dtype=np.int64) * step
+    metric_names = list(results)
+    columns: Dict[str, Dict[str, np.ndarray]] = {}
+    last_index: Dict[str, int] = {}
+
+    for metric_name in metric_names:
+        for result in results[metric_name]:
+            instance = result["metric"].get("instance")
+            if instance is None or not result.get("values"):
+                continue
+            timestamps, samples = sample_arrays(result["values"])
+            index = np.rint((timestamps - start) / step).astype(np.int64)
+            inside = (index >= 0) & (index < size)
+            if not inside.all():
+                index, samples = index[inside], samples[inside]
+            if not len(index):
+                continue
+
+            if instance not in columns:
+                columns[instance] = {}
+                last_index[instance] = -1
+            instance_columns = columns[instance]
+            if metric_name not in instance_columns:
+                instance_columns[metric_name] = np.full(size, np.nan)
+            instance_columns[metric_name][index] = samples
+            last_index[instance] = max(last_index[instance], int(index.max()))
+
+    merged = {}
+    for instance, instance_columns in columns.items():
+        length = last_index[instance] + 1
+        ordered = {}
+        for metric_name in metric_names:
+            column = instance_columns.get(metric_name)
+            if column is None:
+                column = np.full(size, np.nan)
+            column = column[:length]
+            if metric_name == "up":
+                column = np.where(np.isnan(column), 0.0, column)
+            ordered[metric_name] = column
+        timestamps = grid[:length]
+        if "up" not in ordered:
+            # Without `up` there is nothing to fill gaps with, so drop steps that have no samples at all
+            present = ~np.all(np.isnan(np.vstack(list(ordered.values()))), axis=0)
+            timestamps = timestamps[present]
+            ordered = {name: column[present] for name, column in ordered.items()}
+        merged[instance] = MergedSeries(instance, timestamps, ordered, step)
+    return merged
+
+
+def iter_summaries(merged: Dict[str, MergedSeries]) -> Iterator[dict]:
+    """
+    Yield the instance summaries one at a time, removing each series from `merged` once it has been
+    serialized so only one instance is held in row form at any moment.
+    """
+    for instance in list(merged):
+        yield merged.pop(instance).summary()
+
+
+def downsample_series(merged: Dict[str, MergedSeries], max_points: int, method: str = "lttb"):
+    """Downsample every series of `merged` in place (see MergedSeries.downsample)."""
+    for series in merged.values():
+        series.downsample(max_points, method)
+
+
+def encode_summaries(merged: Dict[str, MergedSeries]) -> bytes:
+    """
+    Encode the instance summaries as the JSON array of the device_info response, in one pass with orjson
+    (which writes non-finite floats as null) instead of walking the rows with jsonable_encoder.
+    """
+    summaries = list(iter_summaries(merged))
+    if orjson is not None:
+        return orjson.dumps(summaries)
+    return json.dumps(summaries, allow_nan=False).encode()
+
+
+def ndjson_lines(summaries: Iterable[dict]) -> Iterator[str]:
+    """Encode each summary as one line of newline-delimited JSON."""
+    for summary in summaries:
+        yield json.dumps(summary, allow_nan=False) + "\n"
+
+
+def json_array_chunks(summaries: Iterable[dict]) -> Iterator[str]:
+    """Encode the summaries as a JSON array, one chunk per element."""
+    separator = "["
+    for summary in summaries:
+        yield separator + json.dumps(summary, allow_nan=False)
+        separator = ","
+    yield "[]" if separator == "[" else "]"
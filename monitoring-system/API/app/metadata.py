@@ -0,0 +1,139 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+METADATA_SERIES_MATCH = os.environ.get("METADATA_SERIES_MATCH", '{__name__=~".+"}')   # Series selector pulled into the index
+METADATA_LOOKBACK = int(os.environ.get("METADATA_LOOKBACK", 3600))                     # Seconds of series history indexed
+METADATA_REFRESH_INTERVAL = int(os.environ.get("METADATA_REFRESH_INTERVAL", 300))      # Seconds between two refreshes
+
+
+def prefix_range(values: List[str], prefix: str, limit: Optional[int]) -> List[str]:
+    """Values of a sorted list starting with `prefix`, found by bisection."""
+    start = bisect.bisect_left(values, prefix)
+    found = []
+    for value in values[start:]:
+        if not value.startswith(prefix) or (limit is not None and len(found) >= limit):
+            break
+        found.append(value)
+    return found
+
+
+class SeriesIndex:
+    """
+    In-memory inverted index of the series Prometheus knows about.
+
+    Every refresh pulls `/api/v1/series` (for METADATA_SERIES_MATCH over the last METADATA_LOOKBACK
+    seconds) and `/api/v1/labels`, numbers the series and maps every label name and value to the sorted
+    ids of the series carrying it. Lookups never query Prometheus; a new index replaces the old one at
+    once, so readers always see a complete index.
+    """
+
+    def __init__(self, prometheus, match: str = METADATA_SERIES_MATCH, lookback: int = METADATA_LOOKBACK):
+        self.prometheus = prometheus
+        self.match = match
+        self.lookback = lookback
+        self.series: List[Dict[str, str]] = []
+        self.postings: Dict[str, Dict[str, List[int]]] = {}
+        self.sorted_values: Dict[str, List[str]] = {}
+        self.names: List[str] = []
+        self.device_list: List[dict] = []
+        self.refreshed_at = None
+        self.refreshes = 0
+        self.failures = 0
+        self._lock = None
+
+    async def refresh(self):
+        """Rebuild the index from Prometheus."""
+        now = time.time()
+        window = {"start": now - self.lookback, "end": now}
+        series, names = await asyncio.gather(
+            self.prometheus.api("/series", params={"match[]": self.match, **window}),
+            self.prometheus.api("/labels", params=window)
+        )
+        postings: Dict[str, Dict[str, List[int]]] = {}
+        for id, labels in enumerate(series):
+            for name, value in labels.items():
+                postings.setdefault(name, {}).setdefault(value, []).append(id)
+
+        devices = []
+        for instance, ids in sorted(postings.get("instance", {}).items()):
+            devices.append({
+                "instance": instance,
+                "jobs": sorted({series[id]["job"] for id in ids if "job" in series[id]}),
+                "metrics": len({series[id].get("__name__") for id in ids}),
+                "series": len(ids)
+            })
+
+        self.series = series
+        self.postings = postings
+        self.sorted_values = {name: sorted(values) for name, values in postings.items()}
+        self.names = sorted(set(names) | set(postings))
+        self.device_list = devices
+        self.refreshed_at = now
+        self.refreshes += 1
+
+    async def ensure_fresh(self):
+        """Build the index on first use; afterwards the periodic task keeps it up to date."""
+        if self.refreshed_at is not None:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.refreshed_at is None:
+                await self.refresh()
+
+    def select(self, matchers: Dict[str, str]) -> Optional[List[int]]:
+        """Ids of the series matching every `label: value` pair, smallest posting list first; None without matchers."""
+        if not matchers:
+            return None
+        lists = []
+        for name, value in matchers.items():
+            ids = self.postings.get(name, {}).get(value)
+            if not ids:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        selected = set(lists[0])
+        for ids in lists[1:]:
+            selected.intersection_update(ids)
+        return sorted(selected)
+
+    def label_names(self, prefix: str = "", limit: Optional[int] = 100) -> List[str]:
+        return prefix_range(self.names, prefix, limit)
+
+    def label_values(self, name: str, prefix: str = "", matchers: Dict[str, str] = None, limit: Optional[int] = 100) -> List[str]:
+        """Values of a label, optionally only those of series matching `matchers`, for autocompletion."""
+        ids = self.select(matchers)
+        if ids is None:
+            return prefix_range(self.sorted_values.get(name, []), prefix, limit)
+        values = sorted({self.series[id][name] for id in ids if name in self.series[id]})
+        return prefix_range(values, prefix, limit)
+
+    def devices(self, prefix: str = "", job: str = None) -> List[dict]:
+        return [
+            device for device in self.device_list
+            if device["instance"].startswith(prefix) and (job is None or job in device["jobs"])
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "series": len(self.series),
+            "labels": len(self.names),
+            "devices": len(self.device_list),
+            "refreshed_at": self.refreshed_at,
+            "refreshes": self.refreshes,
+            "failures": self.failures
+        }
+
+    async def run_periodically(self, interval: float = METADATA_REFRESH_INTERVAL):
+        """Background task refreshing the index every `interval` seconds."""
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                self.failures += 1
+                logging.warning(f"Series metadata refresh failed: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,86 @@
+import re
+from typing import Iterable
+
+# Tokens that matter for finding vector selectors; anything else is copied through
+_TOKEN = re.compile(r"""
+    (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`[^`]*`)
+  | (?P<braces>\{(?:"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`[^`]*`|[^}"'`])*\})
+  | (?P<brackets>\[[^\]]*\])
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?:ms|[smhdwy])*)
+  | (?P<identifier>[a-zA-Z_:][a-zA-Z0-9_:]*)
+  | (?P<open>\()
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+KEYWORDS = {"by", "without", "on", "ignoring", "group_left", "group_right", "bool", "offset", "and", "or", "unless", "atan2", "inf", "nan"}
+AGGREGATIONS = {"sum", "min", "max", "avg", "group", "stddev", "stdvar", "count", "count_values", "bottomk", "topk", "quantile", "limitk", "limit_ratio"}
+LABEL_LIST_KEYWORDS = {"by", "without", "on", "ignoring", "group_left", "group_right"}
+
+
+def promql_string(value: str) -> str:
+    """Quote a value as a PromQL double-quoted string literal."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def instance_matcher(instances: Iterable[str]) -> str:
+    """Label matcher selecting the given instances: an equality for one, an anchored regex for several."""
+    instances = list(dict.fromkeys(instances))
+    if len(instances) == 1:
+        return f"instance={promql_string(instances[0])}"
+    return f"instance=~{promql_string('|'.join(re.escape(instance) for instance in instances))}"
+
+
+def inject_matcher(query: str, matcher: str) -> str:
+    """
+    Add a label matcher to every vector selector of a PromQL query, so Prometheus only selects the
+    matching series instead of the API filtering the result.
+
+    `rate(node_cpu_seconds_total{mode!='idle'}[5m])` with `instance="a:9100"` becomes
+    `rate(node_cpu_seconds_total{mode!='idle',instance="a:9100"}[5m])`. Function names, keywords and
+    the label lists of `by`/`without`/`on`/`ignoring`/`group_left`/`group_right` are left alone.
+    """
+    parts = []
+    tokens = list(_TOKEN.finditer(query))
+    skip_label_list = False
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        kind, text = token.lastgroup, token.group()
+        word = text.lower()  # Keywords, aggregations and Inf/NaN are case-insensitive in PromQL
+        if kind == "identifier" and word not in KEYWORDS:
+            following = next((t for t in tokens[i + 1:] if not t.group().isspace()), None)
+            if word in AGGREGATIONS or (following is not None and following.lastgroup == "open"):
+                parts.append(text)  # Aggregation or function call
+            elif following is not None and following.lastgroup == "braces":
+                parts.append(text)
+                # Keep the whitespace between the name and its braces, then extend the braces
+                j = i + 1
+                while tokens[j] is not following:
+                    parts.append(tokens[j].group())
+                    j += 1
+                parts.append(_extend_braces(following.group(), matcher))
+                i = j
+            else:
+                parts.append(f"{text}{{{matcher}}}")
+        elif kind == "braces":
+            parts.append(_extend_braces(text, matcher))  # Selector without a metric name
+        elif kind == "identifier" and word in LABEL_LIST_KEYWORDS:
+            parts.append(text)
+            skip_label_list = True
+        elif kind == "open" and skip_label_list:
+            # Copy the label list of by/without/on/... up to its closing parenthesis
+            end = query.index(")", token.start())
+            parts.append(query[token.start():end + 1])
+            while i + 1 < len(tokens) and tokens[i + 1].start() <= end:
+                i += 1
+            skip_label_list = False
+        else:
+            if not text.isspace():
+                skip_label_list = False
+            parts.append(text)
+        i += 1
+    return "".join(parts)
+
+
+def _extend_braces(braces: str, matcher: str) -> str:
+    inner = braces[1:-1].strip().rstrip(",")
+    return "{" + (f"{inner},{matcher}" if inner else matcher) + "}"
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from typing import Dict, List, Tuple
+from cache import CACHE_MUTABLE_WINDOW
+
+ROLLUP_DB_PATH = os.environ.get("UPTIME_ROLLUP_DB", "uptime_rollups.db")
+ROLLUP_DB_TIMEOUT = float(os.environ.get("UPTIME_ROLLUP_DB_TIMEOUT", 30))   # Seconds to wait for another worker's write lock
+ROLLUP_VERSION = 3          # Bumped when the meaning of the stored counts changes
+ROLLUP_STEP = 60            # Seconds between the `up` samples that are counted
+ROLLUP_CHUNK = 86400        # Seconds of `up` fetched per Prometheus query while rolling up (1440 points)
+ROLLUP_INTERVAL = 3600      # Seconds between background rollup updates
+HOUR = 3600
+DAY = 86400
+
+
+def floor_to(timestamp: float, unit: int) -> int:
+    return int(timestamp // unit) * unit
+
+
+def ceil_to(timestamp: float, unit: int) -> int:
+    return -int(-timestamp // unit) * unit
+
+
+def count_up_samples(result: List[dict], start: int, end: int, step: int, bucket: int) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Count the `up == 1` steps of every instance in buckets of `bucket` seconds.
+
+    The grid runs over [start, end) every `step` seconds; several `up` series of the same instance are
+    combined so a step counts as up if any of them was up. In every bucket, the steps from the first to
+    the last sample of an instance count towards its total, so missed scrapes in between count as down
+    like the gaps `merge_results` fills with 0, while the steps before an instance appeared or after it
+    went away are not counted. Buckets are counted on their own, so the counts do not depend on how a
+    range is split into queries.
+
+    Returns:
+        dict: Mapping of instance to (up steps per bucket, counted steps per bucket).
+    """
+    size = (end - start) // step
+    per_bucket = bucket // step
+    grids: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    for series in result:
+        instance = series["metric"].get("instance")
+        if instance is None or not series.get("values"):
+            continue
+        values = np.array(series["values"], dtype=np.float64)
+        index = np.rint((values[:, 0] - start) / step).astype(np.int64)
+        inside = (index >= 0) & (index < size)
+        index, samples = index[inside], values[inside, 1]
+        if instance not in grids:
+            grids[instance] = (np.zeros(size, dtype=bool), np.zeros(size, dtype=bool))
+        up, seen = grids[instance]
+        up[index] |= samples == 1
+        seen[index] = True
+
+    buckets = size // per_bucket
+    counts = {}
+    for instance, (up, seen) in grids.items():
+        seen = seen[:buckets * per_bucket].reshape(buckets, per_bucket)
+        first = seen.argmax(axis=1)
+        last = per_bucket - 1 - seen[:, ::-1].argmax(axis=1)
+        counts[instance] = (
+            up[:buckets * per_bucket].reshape(buckets, per_bucket).sum(axis=1),
+            np.where(seen.any(axis=1), last - first + 1, 0)
+        )
+    return counts
+
+
+class UptimeRollups:
+    """
+    Persisted per-instance rollups of `up` samples, kept in SQLite.
+
+    Hourly rows hold the number of steps an instance was up and the number of steps counted in the hour
+    (see count_up_samples); daily rows are summed from the hourly ones. The covered hours form one contiguous window
+    [covered_from, covered_to) stored as the watermark, which is extended forward incrementally and
+    backfilled on demand. An uptime query over any range reads daily rows for whole days, hourly rows
+    for the whole hours around them, and only queries Prometheus for the partial hours at both ends.
+    """
+
+    def __init__(self, prometheus, db_path: str = ROLLUP_DB_PATH, step: int = ROLLUP_STEP):
+        self.prometheus = prometheus
+        self.db_path = db_path
+        self.step = step
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._lock = None
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            # Every uvicorn worker rolls up into the same file, so wait for the others' writes
+            self._db = sqlite3.connect(self.db_path, timeout=ROLLUP_DB_TIMEOUT, check_same_thread=False)
+            self._db.execute(f"PRAGMA busy_timeout = {int(ROLLUP_DB_TIMEOUT * 1000)}")
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS uptime_rollups (
+                    instance TEXT NOT NULL,
+                    resolution INTEGER NOT NULL,
+                    bucket_start INTEGER NOT NULL,
+                    up_samples INTEGER NOT NULL,
+                    total_samples INTEGER NOT NULL,
+                    PRIMARY KEY (instance, resolution, bucket_start)
+                );
+                CREATE TABLE IF NOT EXISTS rollup_state (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+            stored_step, stored_version = self._state("step"), self._state("version")
+            if stored_step is not None and (stored_step != self.step or stored_version != ROLLUP_VERSION):
+                # Counts taken at another step or with another meaning are not comparable, start over
+                self._db.executescript("DELETE FROM uptime_rollups; DELETE FROM rollup_state;")
+            self._set_state(step=self.step, version=ROLLUP_VERSION)
+        return self._db
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _run_db(self, function, *args, **kwargs):
+        """Run a function using the database in a worker thread, so lock waits and writes never block the event loop."""
+        def run():
+            with self._db_lock:
+                return function(*args, **kwargs)
+        return await asyncio.to_thread(run)
+
+    def _state(self, key: str):
+        row = self.db.execute("SELECT value FROM rollup_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, **values):
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO rollup_state (key, value) VALUES (?, ?)", values.items())
+
+    def watermark(self) -> Tuple[int, int]:
+        """Covered window [covered_from, covered_to) of the hourly rollups, or (None, None)."""
+        return self._state("covered_from"), self._state("covered_to")
+
+    def last_complete_hour(self) -> int:
+        """End of the last hour whose samples can no longer change."""
+        return floor_to(time.time() - CACHE_MUTABLE_WINDOW, HOUR)
+
+    async def _roll_up(self, start: int, end: int):
+        """Fetch `up` for the hours in [start, end) and write their hourly and daily rows."""
+        chunks = [(chunk, min(chunk + ROLLUP_CHUNK, end)) for chunk in range(start, end, ROLLUP_CHUNK)]
+        results = await asyncio.gather(*(self.prometheus.fetch_range("up", chunk_start, chunk_end - self.step, self.step) for chunk_start, chunk_end in chunks))
+        rows = []
+        for (chunk_start, chunk_end), result in zip(chunks, results):
+            for instance, (up, total) in count_up_samples(result, chunk_start, chunk_end, self.step, HOUR).items():
+                for hour in np.flatnonzero(total):
+                    rows.append((instance, HOUR, chunk_start + int(hour) * HOUR, int(up[hour]), int(total[hour])))
+        await self._run_db(self._write_rows, rows, start, end)
+
+    def _write_rows(self, rows: list, start: int, end: int):
+        """Store hourly rows and recompute the daily rows of the days they touch."""
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO uptime_rollups VALUES (?, ?, ?, ?, ?)", rows)
+            self.db.execute("""
+                INSERT OR REPLACE INTO uptime_rollups
+                SELECT instance, ?, bucket_start - bucket_start % ?, SUM(up_samples), SUM(total_samples)
+                FROM uptime_rollups
+                WHERE resolution = ? AND bucket_start >= ? AND bucket_start < ?
+                GROUP BY instance, bucket_start - bucket_start % ?
+            """, (DAY, DAY, HOUR, floor_to(start, DAY), ceil_to(end, DAY), DAY))
+
+    async def update(self, start: int = None, end: int = None):
+        """
+        Extend the covered window so it contains [start, end) (whole hours), up to the last complete hour.
+        Without arguments the window is only extended forward from the watermark.
+        """
+        async with self.lock:
+            covered_from, covered_to = await self._run_db(self.watermark)
+            end = min(end if end is not None else self.last_complete_hour(), self.last_complete_hour())
+            if covered_from is None:
+                if start is None or start >= end:
+                    return
+                await self._roll_up(start, end)
+                await self._run_db(self._set_state, covered_from=start, covered_to=end)
+                return
+            if start is not None and start < covered_from:
+                await self._roll_up(start, covered_from)
+                await self._run_db(self._set_state, covered_from=start)
+            if end > covered_to:
+                await self._roll_up(covered_to, end)
+                await self._run_db(self._set_state, covered_to=end)
+
+    def _rollup_counts(self, resolution: int, start: int, end: int) -> Dict[str, Tuple[int, int]]:
+        if start >= end:
+            return {}
+        rows = self.db.execute("""
+            SELECT instance, SUM(up_samples), SUM(total_samples) FROM uptime_rollups
+            WHERE resolution = ? AND bucket_start >= ? AND bucket_start < ?
+            GROUP BY instance
+        """, (resolution, start, end)).fetchall()
+        return {instance: (up, total) for instance, up, total in rows}
+
+    async def _live_counts(self, start: int, end: int) -> Dict[str, Tuple[int, int]]:
+        if start >= end:
+            return {}
+        result = await self.prometheus.fetch_range("up", start, end - self.step, self.step)
+        counts = count_up_samples(result, start, end, self.step, end - start)
+        return {instance: (int(up.sum()), int(total.sum())) for instance, (up, total) in counts.items()}
+
+    async def uptime(self, start: float, end: float) -> List[dict]:
+        """
+        Uptime of every instance over [start, end).
+
+        Returns:
+            list: One entry per instance with the same uptime block as `/prometheus/device_info`.
+        """
+        start, end = ceil_to(start, self.step), floor_to(end, self.step)
+        first_hour, last_hour = ceil_to(start, HOUR), min(floor_to(end, HOUR), self.last_complete_hour())
+        parts = []
+        if first_hour < last_hour:
+            await self.update(first_hour, last_hour)
+            first_day, last_day = ceil_to(first_hour, DAY), floor_to(last_hour, DAY)
+            if first_day < last_day:
+                parts.append(await self._run_db(self._rollup_counts, DAY, first_day, last_day))
+                parts.append(await self._run_db(self._rollup_counts, HOUR, first_hour, first_day))
+                parts.append(await self._run_db(self._rollup_counts, HOUR, last_day, last_hour))
+            else:
+                parts.append(await self._run_db(self._rollup_counts, HOUR, first_hour, last_hour))
+            live = await asyncio.gather(self._live_counts(start, first_hour), self._live_counts(last_hour, end))
+        else:
+            live = [await self._live_counts(start, end)]
+        parts.extend(live)
+
+        totals: Dict[str, List[int]] = {}
+        for counts in parts:
+            for instance, (up, total) in counts.items():
+                instance_totals = totals.setdefault(instance, [0, 0])
+                instance_totals[0] += up
+                instance_totals[1] += total
+
+        return [
+            {
+                "instance": instance,
+                "uptime": {
+                    "total_time_seconds": total * self.step,
+                    "uptime_time_seconds": up * self.step,
+                    "uptime_percentage": (up / total) * 100 if total > 0 else 0
+                }
+            }
+            for instance, (up, total) in sorted(totals.items())
+        ]
+
+    async def run_periodically(self, interval: float = ROLLUP_INTERVAL):
+        """Background task extending the rollups every `interval` seconds once they have been started."""
+        while True:
+            try:
+                await self.update()
+            except Exception as e:
+                logging.warning(f"Uptime rollup update failed: {e}")
+            await asyncio.sleep(interval)
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,224 @@
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+from typing import Callable, Optional
+from ingest import AlertGroupRecord, dumps, parse_alert_group
+
+SHARED_STATE_BACKENDS = ("memory", "unix")
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "memory")
+SHARED_STATE_SOCKET = os.environ.get("SHARED_STATE_SOCKET", "/tmp/monitoring-api.sock")
+RECONNECT_DELAY = 0.5                       # Seconds between two attempts to reach or become the broker
+PEER_MAX_BUFFER = 64 * 1024 * 1024          # Bytes buffered for a worker before the broker disconnects it
+
+# Worker -> broker: kind, payload length, value (alert count of a PUBLISH, last seen seq of a HELLO)
+REQUEST_HEADER = struct.Struct("!BIQ")
+HELLO, PUBLISH = 0, 1
+# Broker -> worker: payload length, seq of the first alert of the group
+DELIVERY_HEADER = struct.Struct("!IQ")
+# Last seq the broker assigned, kept at the start of the lock file so the next broker continues from it
+LOCK_FILE_SEQ = struct.Struct("!Q")
+
+
+class MemoryBackend:
+    """
+    Single process backend (the default): a published alert group is handed straight to the handler.
+    Sequence numbers are assigned by the local broadcast hub.
+    """
+    name = "memory"
+
+    def __init__(self):
+        self.handler = None
+        self.published = 0
+
+    async def start(self, handler: Callable[[AlertGroupRecord, Optional[int]], None], last_seq: Callable[[], int] = None):
+        """
+        Args:
+            handler (Callable): Called with every alert group to apply and the seq of its first alert, or None.
+            last_seq (Callable, optional): Returns the last seq this worker has seen.
+        """
+        self.handler = handler
+
+    def publish(self, alert_group: AlertGroupRecord):
+        self.published += 1
+        self.handler(alert_group, None)
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "published": self.published}
+
+
+class UnixSocketBackend(MemoryBackend):
+    """
+    Backend for several uvicorn workers on one host, without outside services.
+
+    One worker is elected broker by holding an exclusive lock on `<socket>.lock` and listens on a Unix
+    socket; every worker (the broker's own included) connects to it. Alert groups published by a worker
+    are sent to the broker, which numbers their alerts with one global sequence and sends every group to
+    all workers in the same order. Each worker applies them to its own alert store and broadcast hub, so
+    the stores hold the same alerts and a WebSocket client can reconnect to any worker with `since_seq`.
+
+    When the broker goes away the lock is released and the first worker to take it becomes the new
+    broker; the others reconnect. The broker writes the last seq it assigned to the lock file, and every
+    worker reports the highest seq it received when it connects, so a new broker never hands out a seq
+    that was already used. While a worker is not connected it applies its own groups locally.
+    """
+    name = "unix"
+
+    def __init__(self, path: str = SHARED_STATE_SOCKET):
+        super().__init__()
+        self.path = path
+        self.last_seq = None
+        self.is_broker = False
+        self.received = 0
+        self.fallbacks = 0
+        self.reconnects = 0
+        self.seen_seq = 0
+        self._lock_file = None
+        self._server = None
+        self._peers = set()
+        self._broker_seq = 0
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task = None
+
+    async def start(self, handler: Callable[[AlertGroupRecord, Optional[int]], None], last_seq: Callable[[], int] = None):
+        self.handler = handler
+        self.last_seq = last_seq or (lambda: 0)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # Broker side
+
+    async def _try_become_broker(self):
+        if self._server is not None:
+            return
+        lock_file = os.fdopen(os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o644), "r+b", buffering=0)
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # Left over by a broker that is gone, the lock proves nobody listens
+        self._lock_file = lock_file
+        stored = os.pread(lock_file.fileno(), LOCK_FILE_SEQ.size, 0)
+        stored_seq = LOCK_FILE_SEQ.unpack(stored)[0] if len(stored) == LOCK_FILE_SEQ.size else 0
+        self._broker_seq = max(stored_seq, self.highest_seq())
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+        self.is_broker = True
+        logging.info(f"Shared state broker listening on {self.path}")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        try:
+            while True:
+                kind, length, value = REQUEST_HEADER.unpack(await reader.readexactly(REQUEST_HEADER.size))
+                payload = await reader.readexactly(length) if length else b""
+                if kind == HELLO:
+                    self._broker_seq = max(self._broker_seq, value)
+                    continue
+                first_seq = self._broker_seq + 1
+                self._broker_seq += value
+                os.pwrite(self._lock_file.fileno(), LOCK_FILE_SEQ.pack(self._broker_seq), 0)
+                frame = DELIVERY_HEADER.pack(len(payload), first_seq) + payload
+                for peer in list(self._peers):
+                    if peer.transport.get_write_buffer_size() > PEER_MAX_BUFFER:
+                        # The worker cannot keep up; it reconnects and its clients get a snapshot
+                        self._peers.discard(peer)
+                        peer.close()
+                        continue
+                    peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._peers.discard(writer)
+            writer.close()
+
+    # Worker side
+
+    def highest_seq(self) -> int:
+        """Highest seq this worker has seen, received from a broker or applied by its hub."""
+        return max(self.seen_seq, self.last_seq())
+
+    async def _run(self):
+        while True:
+            try:
+                await self._try_become_broker()
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                writer.write(REQUEST_HEADER.pack(HELLO, 0, self.highest_seq()))
+                self._writer = writer
+                await self._receive(reader)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                if self._writer is not None:
+                    logging.warning(f"Lost the shared state broker: {e}")
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                    self.reconnects += 1
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        while True:
+            length, first_seq = DELIVERY_HEADER.unpack(await reader.readexactly(DELIVERY_HEADER.size))
+            payload = await reader.readexactly(length)
+            self.received += 1
+            try:
+                alert_group = parse_alert_group(payload)
+                self.seen_seq = max(self.seen_seq, first_seq + len(alert_group.alerts) - 1)
+                self.handler(alert_group, first_seq)
+            except Exception as e:
+                logging.exception(f"Applying a shared alert group failed: {e}")
+
+    def publish(self, alert_group: AlertGroupRecord):
+        self.published += 1
+        if self._writer is None or self._writer.is_closing():
+            self.fallbacks += 1
+            self.handler(alert_group, None)
+            return
+        payload = dumps(alert_group.raw).encode()
+        self._writer.write(REQUEST_HEADER.pack(PUBLISH, len(payload), len(alert_group.alerts)) + payload)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            await asyncio.sleep(0)  # Let the connection handlers see the closed connections and finish
+            self._server = None
+            self.is_broker = False
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "socket": self.path,
+            "role": "broker" if self.is_broker else "worker",
+            "connected": self._writer is not None,
+            "peers": len(self._peers),
+            "published": self.published,
+            "received": self.received,
+            "fallbacks": self.fallbacks,
+            "reconnects": self.reconnects
+        }
+
+
+def create_backend(name: str = SHARED_STATE_BACKEND):
+    """Create the shared state backend selected by `SHARED_STATE_BACKEND`."""
+    if name not in SHARED_STATE_BACKENDS:
+        raise ValueError(f"Invalid shared state backend. Must be one of: {', '.join(SHARED_STATE_BACKENDS)}")
+    return UnixSocketBackend() if name == "unix" else MemoryBackend()
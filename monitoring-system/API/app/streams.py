@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Tuple
+from fastapi import WebSocket
+from broadcast import CLIENT_QUEUE_SIZE, SLOW_CLIENT_POLICY, Subscriber
+from cache import align_range, normalize_query
+from merge import merge_results
+
+STREAM_DELAY = int(os.environ.get("METRICS_STREAM_DELAY", 15))            # Seconds given to scrapes to land before a step is pushed
+STREAM_MIN_INTERVAL = int(os.environ.get("METRICS_STREAM_MIN_INTERVAL", 5))  # Shortest time between two polls of a stream
+
+
+def stream_key(metrics: Dict[str, str], step: int) -> Tuple[tuple, int]:
+    """Key of a metric stream, equal for metric sets that only differ by whitespace in the queries."""
+    return tuple((name, normalize_query(query)) for name, query in metrics.items()), step
+
+
+class MetricPoller:
+    """
+    Shared poller of one metric set at one step.
+
+    Every `step` seconds (at least STREAM_MIN_INTERVAL) the steps completed since the last poll are
+    queried once (straight from Prometheus, the query cache only serves initial windows) and the new points of every instance are encoded once and offered to all the clients of
+    the stream. A new client gets its initial window while the poller is paused, so the window ends
+    exactly where the next update starts.
+    """
+
+    def __init__(self, prometheus, metrics: Dict[str, str], step: int, delay: int = STREAM_DELAY):
+        self.prometheus = prometheus
+        self.metrics = metrics
+        self.step = step
+        self.delay = delay
+        self.interval = max(step, STREAM_MIN_INTERVAL)
+        self.subscribers = set()
+        self.joining = 0
+        self.cursor = self.current_end()
+        self.polls = 0
+        self.updates = 0
+        self.failures = 0
+        self.lock = asyncio.Lock()
+        self.task = None
+
+    def current_end(self) -> int:
+        """Last step that is old enough to be complete."""
+        return align_range(0, time.time() - self.delay, self.step)[1]
+
+    def start(self):
+        """Start the poll loop, or restart it if it has ended."""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def initial_window(self, window: int) -> str:
+        """Encode the `window` seconds up to the cursor, in the device_info summary format."""
+        start, end = align_range(self.cursor - window, self.cursor, self.step)
+        results = await self.prometheus.query_ranges(self.metrics, start, end, self.step)
+        merged = merge_results(results, start, end, self.step)
+        return json.dumps({
+            "type": "snapshot",
+            "step": self.step,
+            "devices": [series.summary() for series in merged.values()]
+        })
+
+    async def poll(self):
+        end = self.current_end()
+        if end <= self.cursor:
+            return
+        start = self.cursor + self.step
+        self.polls += 1
+        # Polls bypass the query cache: storing these short windows would replace the dashboard's cached window
+        names = list(self.metrics)
+        parts = await asyncio.gather(*(self.prometheus.fetch_sharded(self.metrics[name], start, end, self.step) for name in names))
+        results = dict(zip(names, parts))
+        merged = merge_results(results, start, end, self.step)
+        self.cursor = end
+        devices = [{"instance": series.instance, "metrics": series.to_records()} for series in merged.values() if len(series)]
+        if not devices:
+            return
+        self.updates += 1
+        text = json.dumps({"type": "update", "devices": devices})
+        for subscriber in list(self.subscribers):
+            if not subscriber.offer(text):
+                self.subscribers.discard(subscriber)
+                asyncio.create_task(close_subscriber(subscriber))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            async with self.lock:
+                try:
+                    await self.poll()
+                except Exception as e:
+                    self.failures += 1
+                    logging.warning(f"Metric stream poll failed: {getattr(e, 'message', e)}")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self.task = None
+
+
+async def close_subscriber(subscriber: Subscriber, code: int = 1013):
+    subscriber.closed = True
+    if subscriber.task is not None:
+        subscriber.task.cancel()
+    try:
+        await subscriber.websocket.close(code=code)
+    except Exception:
+        pass
+
+
+class MetricStreams:
+    """
+    Registry of the shared metric pollers: clients asking for the same metric set and step share one
+    MetricPoller, so N viewers cost one upstream query per step. A poller stops with its last client.
+    """
+
+    def __init__(self, prometheus, queue_size: int = CLIENT_QUEUE_SIZE, policy: str = SLOW_CLIENT_POLICY):
+        self.prometheus = prometheus
+        self.queue_size = queue_size
+        self.policy = policy
+        self.pollers: Dict[tuple, MetricPoller] = {}
+
+    async def subscribe(self, websocket: WebSocket, metrics: Dict[str, str], step: int, window: int) -> Tuple[MetricPoller, Subscriber]:
+        """
+        Attach an accepted WebSocket to the stream of `metrics` at `step`, after queueing its initial window.
+
+        Raises:
+            PrometheusQueryError: If the initial window cannot be queried.
+        """
+        key = stream_key(metrics, step)
+        poller = self.pollers.get(key)
+        if poller is None:
+            poller = self.pollers[key] = MetricPoller(self.prometheus, metrics, step)
+        poller.start()
+        subscriber = Subscriber(websocket, self.queue_size, self.policy)
+        poller.joining += 1  # Keeps the poller alive while the window is fetched
+        try:
+            async with poller.lock:
+                subscriber.offer(await poller.initial_window(window))
+                poller.subscribers.add(subscriber)
+        finally:
+            poller.joining -= 1
+            await self._release(poller)
+        subscriber.task = asyncio.create_task(subscriber.run())
+        return poller, subscriber
+
+    async def unsubscribe(self, poller: MetricPoller, subscriber: Subscriber):
+        poller.subscribers.discard(subscriber)
+        subscriber.closed = True
+        if subscriber.task is not None and not subscriber.task.done():
+            subscriber.task.cancel()
+            try:
+                await subscriber.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        await self._release(poller)
+
+    async def _release(self, poller: MetricPoller):
+        """Stop a poller nobody listens to anymore."""
+        key = stream_key(poller.metrics, poller.step)
+        if not poller.subscribers and not poller.joining and self.pollers.get(key) is poller:
+            del self.pollers[key]
+            await poller.stop()
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                "metrics": list(poller.metrics),
+                "step": poller.step,
+                "clients": len(poller.subscribers),
+                "polls": poller.polls,
+                "updates": poller.updates,
+                "failures": poller.failures
+            }
+            for poller in self.pollers.values()
+        ]
+
+    async def close(self):
+        for poller in list(self.pollers.values()):
+            for subscriber in list(poller.subscribers):
+                await self.unsubscribe(poller, subscriber)
+            await poller.stop()
+        self.pollers.clear()
@@ -0,0 +1,148 @@
+import re
+from typing import Dict, Iterable, List, Optional, Set
+
+MATCHER_PATTERN = re.compile(r'^\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"?(.*?)"?\s*$')
+TOP_LEVEL_FIELDS = ("status", "fingerprint")   # Matched against the alert itself, every other name against its labels
+
+
+def field_value(alert: dict, name: str) -> Optional[str]:
+    if name in TOP_LEVEL_FIELDS:
+        return alert.get(name)
+    return (alert.get("labels") or {}).get(name)
+
+
+class Matcher:
+    """
+    One Prometheus style label matcher: `name=value`, `name!=value`, `name=~regex` or `name!~regex`.
+    Regular expressions are anchored like in PromQL. An equality matcher may list several values
+    separated by commas (`instance=a:9100,b:9100`).
+    """
+    __slots__ = ("name", "op", "value", "values", "regex")
+
+    def __init__(self, name: str, op: str, value: str):
+        self.name = name
+        self.op = op
+        self.value = value
+        self.values = frozenset(value.split(",")) if op in ("=", "!=") else None
+        try:
+            self.regex = re.compile(value) if op in ("=~", "!~") else None
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression in matcher {name}{op}{value}: {e}")
+
+    def matches(self, alert: dict) -> bool:
+        value = field_value(alert, self.name)
+        if self.op == "=":
+            return value in self.values
+        if self.op == "!=":
+            return value not in self.values
+        matched = self.regex.fullmatch(value or "") is not None
+        return matched if self.op == "=~" else not matched
+
+    def __repr__(self):
+        return f"{self.name}{self.op}\"{self.value}\""
+
+
+def parse_matcher(text: str) -> Matcher:
+    """
+    Parse a matcher such as `instance="node_exporter:9100"` or `job=~"node.*"`.
+
+    Raises:
+        ValueError: If the text is not a valid matcher.
+    """
+    match = MATCHER_PATTERN.match(text)
+    if not match:
+        raise ValueError(f"Invalid matcher: {text}. Expected name=value, name!=value, name=~regex or name!~regex")
+    return Matcher(*match.groups())
+
+
+class Subscription:
+    """The set of matchers a client subscribed with; an alert is delivered if it matches all of them."""
+    __slots__ = ("matchers", "anchor")
+
+    def __init__(self, matchers: List[Matcher]):
+        self.matchers = matchers
+        # The equality matcher with the fewest values routes the alerts to this subscription
+        equalities = [matcher for matcher in matchers if matcher.op == "="]
+        self.anchor = min(equalities, key=lambda matcher: len(matcher.values)) if equalities else None
+
+    def matches(self, alert: dict) -> bool:
+        return all(matcher.matches(alert) for matcher in self.matchers)
+
+    @classmethod
+    def from_params(cls, matchers: Iterable[str] = (), status: str = None, severity: str = None, instance: str = None) -> Optional["Subscription"]:
+        """
+        Build a subscription from the `match`, `status`, `severity` and `instance` query parameters
+        of a WebSocket connection, or None when no filter was given.
+
+        Raises:
+            ValueError: If a matcher is invalid.
+        """
+        parsed = [parse_matcher(text) for text in matchers]
+        for name, value in (("status", status), ("severity", severity), ("instance", instance)):
+            if value:
+                parsed.append(Matcher(name, "=", value))
+        return cls(parsed) if parsed else None
+
+
+class SubscriptionIndex:
+    """
+    Index of the filtered clients of a broadcast.
+
+    Clients with an equality matcher are indexed by its label name and values, so routing an alert only
+    looks up the alert's own label values and checks the clients found there. Clients without filters
+    receive everything; clients with only negative or regex matchers are checked for every alert.
+    """
+
+    def __init__(self):
+        self.unfiltered: Set[object] = set()
+        self.scanned: Set[object] = set()
+        self.anchored: Dict[str, Dict[str, Set[object]]] = {}
+        self._subscriptions: Dict[object, Optional[Subscription]] = {}
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def add(self, client, subscription: Optional[Subscription]):
+        self._subscriptions[client] = subscription
+        if subscription is None:
+            self.unfiltered.add(client)
+        elif subscription.anchor is None:
+            self.scanned.add(client)
+        else:
+            by_value = self.anchored.setdefault(subscription.anchor.name, {})
+            for value in subscription.anchor.values:
+                by_value.setdefault(value, set()).add(client)
+
+    def remove(self, client):
+        subscription = self._subscriptions.pop(client, None)
+        self.unfiltered.discard(client)
+        self.scanned.discard(client)
+        if subscription is None or subscription.anchor is None:
+            return
+        by_value = self.anchored[subscription.anchor.name]
+        for value in subscription.anchor.values:
+            clients = by_value[value]
+            clients.discard(client)
+            if not clients:
+                del by_value[value]
+        if not by_value:
+            del self.anchored[subscription.anchor.name]
+
+    def subscription(self, client) -> Optional[Subscription]:
+        return self._subscriptions.get(client)
+
+    def accepts(self, client, alert: dict) -> bool:
+        subscription = self._subscriptions.get(client)
+        return subscription is None or subscription.matches(alert)
+
+    def route(self, alert: dict) -> List[object]:
+        """Clients the alert has to be delivered to."""
+        targets = list(self.unfiltered)
+        for client in self.scanned:
+            if self._subscriptions[client].matches(alert):
+                targets.append(client)
+        for name, by_value in self.anchored.items():
+            clients = by_value.get(field_value(alert, name))
+            if clients:
+                targets.extend(client for client in clients if self._subscriptions[client].matches(alert))
+        return targets
@@ -0,0 +1,158 @@
+import os
+import re
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+
+DURATION_UNITS = {
+    "ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "y": 365 * 86400,
+    "second": 1, "minute": 60, "hour": 3600, "day": 86400, "week": 7 * 86400, "month": 30 * 86400, "year": 365 * 86400
+}
+MAX_POINTS_PER_SERIES = int(os.environ.get("MAX_POINTS_PER_SERIES", 50000))   # Largest number of steps a range query may ask for
+AUTO_STEP_POINTS = 500                                                       # Points per series aimed at by step=auto
+NICE_STEPS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)
+
+# A PromQL duration ('90s', '1h30m', '2d') or the older single word form ('30minute', '5hours')
+_DURATION = r"(?:\d+(?:\.\d+)?\s*(?:seconds?|minutes?|hours?|days?|weeks?|months?|years?|ms|s|m|h|d|w|y)\s*)+"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)\s*(seconds?|minutes?|hours?|days?|weeks?|months?|years?|ms|s|m|h|d|w|y)")
+_DURATION_PATTERN = re.compile(rf"^\s*(?:(?P<duration>{_DURATION})|(?P<seconds>\d+(?:\.\d+)?))\s*$")
+
+_TIME_PATTERN = re.compile(rf"""
+    ^\s*(?:
+        (?P<now>now)(?:\s*(?P<sign>[+-])\s*(?P<offset>{_DURATION}))?
+      | (?P<year>\d{{4}})-(?P<month>\d{{2}})-(?P<day>\d{{2}})
+        (?:[Tt\ ](?P<hour>\d{{2}}):(?P<minute>\d{{2}})(?::(?P<second>\d{{2}})(?P<fraction>\.\d+)?)?)?
+        \s*(?P<zone>[Zz]|[+-]\d{{2}}:?\d{{2}})?
+      | (?P<ago>{_DURATION})
+      | (?P<epoch>\d+(?:\.\d+)?)
+    )\s*$
+""", re.VERBOSE)
+
+
+def _duration_seconds(text: str) -> float:
+    return sum(float(amount) * DURATION_UNITS[unit.rstrip("s") if len(unit) > 2 else unit] for amount, unit in _DURATION_PART.findall(text))
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parse a duration into seconds: a PromQL duration ('15s', '5m', '1h30m', '2w'), the word form used by
+    relative times ('10minute', '2days') or a plain number of seconds ('90').
+
+    Raises:
+        ValueError: If the value is not a duration.
+    """
+    match = _DURATION_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Invalid duration: {value}. Must be like '30s', '5m', '1h30m', '10minute' or a number of seconds")
+    if match.group("seconds"):
+        return float(match.group("seconds"))
+    return _duration_seconds(match.group("duration"))
+
+
+def parse_timestamp(value: str, now: Optional[float] = None) -> float:
+    """
+    Parse a point in time into unix seconds, with a single compiled pattern.
+
+    Accepted forms:
+        - 'now', optionally shifted by a duration ('now-6h', 'now-1h30m', 'now+5m')
+        - ISO 8601 / RFC 3339 ('2024-12-01T00:00:00Z', '2024-12-01T03:00:00.5+03:00', '2024-12-01'),
+          read as UTC when no offset is given
+        - a duration before now ('6h', '1h30m', '30minute', '5hour', '1month')
+        - unix seconds ('1733011200', '1733011200.5')
+
+    Args:
+        value (str): The time to parse.
+        now (float, optional): Reference time for 'now' and relative times. Defaults to the current time.
+
+    Raises:
+        ValueError: If the value matches none of the forms or is not a valid date.
+    """
+    match = _TIME_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"Invalid time: {value}. Must be 'now', 'now-6h', an ISO timestamp, a duration before now like '30m' or '10minute', or unix seconds")
+    groups = match.groupdict()
+    if groups["now"]:
+        now = now if now is not None else time.time()
+        if groups["offset"]:
+            return now + _duration_seconds(groups["offset"]) * (1 if groups["sign"] == "+" else -1)
+        return now
+    if groups["epoch"]:
+        return float(groups["epoch"])
+    if groups["ago"]:
+        return (now if now is not None else time.time()) - _duration_seconds(groups["ago"])
+
+    try:
+        timestamp = datetime(
+            int(groups["year"]), int(groups["month"]), int(groups["day"]),
+            int(groups["hour"] or 0), int(groups["minute"] or 0), int(groups["second"] or 0),
+            tzinfo=timezone.utc
+        ).timestamp()
+    except ValueError as e:
+        raise ValueError(f"Invalid time: {value}, {e}")
+    if groups["fraction"]:
+        timestamp += float(groups["fraction"])
+    zone = groups["zone"]
+    if zone and zone not in ("Z", "z"):
+        sign = -1 if zone[0] == "-" else 1
+        digits = zone[1:].replace(":", "")
+        timestamp -= sign * (int(digits[:2]) * 3600 + int(digits[2:]) * 60)
+    return timestamp
+
+
+@lru_cache(maxsize=4096)
+def _format_second(second: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(second))
+
+
+def format_epoch(timestamp: float) -> str:
+    """Format unix seconds as a UTC ISO 8601 string with a `Z` suffix, memoized per second."""
+    return _format_second(int(timestamp // 1))
+
+
+def format_epochs(timestamps) -> List[str]:
+    """
+    Format an array of unix seconds as UTC ISO 8601 strings with a `Z` suffix in one NumPy call.
+
+    Fractions are truncated to the second. Unless the seconds are strictly increasing (a step grid),
+    each distinct second is formatted once and the strings are shared by its repetitions.
+    """
+    seconds = np.floor(np.asarray(timestamps, dtype=np.float64)).astype(np.int64)
+    if len(seconds) < 2 or bool(np.all(seconds[1:] > seconds[:-1])):
+        formatted = np.datetime_as_string(seconds.astype("datetime64[s]"), unit="s").tolist()
+        return [timestamp + "Z" for timestamp in formatted]
+    unique, inverse = np.unique(seconds, return_inverse=True)
+    formatted = [timestamp + "Z" for timestamp in np.datetime_as_string(unique.astype("datetime64[s]"), unit="s").tolist()]
+    return [formatted[i] for i in inverse.tolist()]
+
+
+def nice_step(min_step: float) -> int:
+    """Smallest round step (1s, 2s, 5s, 10s, 15s, 30s, 1m, ... 1d, then whole days) of at least `min_step` seconds."""
+    for step in NICE_STEPS:
+        if step >= min_step:
+            return step
+    return -int(-min_step // 86400) * 86400
+
+
+def resolve_step(start: float, end: float, step: str, max_points: int = MAX_POINTS_PER_SERIES) -> int:
+    """
+    Step in whole seconds for a range query over [start, end].
+
+    'auto' picks the round step giving about AUTO_STEP_POINTS points. Any step that would give more than
+    `max_points` points per series is raised to the smallest round step that stays within the limit.
+
+    Raises:
+        ValueError: If the step is not 'auto' or a duration of at least one second.
+    """
+    span = max(end - start, 0)
+    if step == "auto":
+        seconds = nice_step(span / AUTO_STEP_POINTS)
+    else:
+        seconds = parse_duration(step)
+        if seconds < 1 or seconds != int(seconds):
+            raise ValueError(f"Invalid step: {step}. Must be a whole number of seconds, at least 1s")
+        seconds = int(seconds)
+    if span // seconds + 1 > max_points:
+        seconds = nice_step(span / (max_points - 1))
+    return seconds